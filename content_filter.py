@@ -10,6 +10,10 @@ import csv
 import nltk
 from nltk import word_tokenize, FreqDist
 from nltk.corpus import stopwords
+
+from utils.metrics import Metrics
+from utils.profiling import Profiler
+from utils.compression import Compression
 nltk.download
 nltk.download('wordnet')
 nltk.download('stopwords')
@@ -19,32 +23,37 @@ nltk.download('stopwords')
 
 ''' TODO: create ContentFilter class with below functionality '''
 
+_metrics = Metrics.scope('content')
+
 
 def clean(file):
-    # remove mentions
-    file = re.sub(r'@[A-Za-z0-9]+', '', str(file))
-    # remove hashtags
-    file = re.sub(r'#', '', file)
-    # remove RT and FAV
-    file = re.sub(r'RT[\s]+', '', file)
-    # remove URLs
-    file = re.sub(r'https?:\/\/\S+|www.\.\S+', '', file)
-    # remove punctuation
-    file = re.sub(r'[^\w\s]', '', file)
-    # lower case text
-    file = str.lower(file)
+    with _metrics.timer('clean').time():
+        # remove mentions
+        file = re.sub(r'@[A-Za-z0-9]+', '', str(file))
+        # remove hashtags
+        file = re.sub(r'#', '', file)
+        # remove RT and FAV
+        file = re.sub(r'RT[\s]+', '', file)
+        # remove URLs
+        file = re.sub(r'https?:\/\/\S+|www.\.\S+', '', file)
+        # remove punctuation
+        file = re.sub(r'[^\w\s]', '', file)
+        # lower case text
+        file = str.lower(file)
     return file
 # remove numbers, lemmatize, and remove stop words
 
 
 def lem_stop(tweetText):
-    lemmatizer = nltk.stem.WordNetLemmatizer()
-    tokenizer = TweetTokenizer()
-    no_num = ''.join(word for word in tweetText if not word.isdigit())
-    lem = [(lemmatizer.lemmatize(word))
-           for word in tokenizer.tokenize((no_num))]
-    stop_words = set(stopwords.words('english'))
-    return [word for word in lem if not word in stop_words]
+    with _metrics.timer('lem_stop').time():
+        lemmatizer = nltk.stem.WordNetLemmatizer()
+        tokenizer = TweetTokenizer()
+        no_num = ''.join(word for word in tweetText if not word.isdigit())
+        lem = [(lemmatizer.lemmatize(word))
+               for word in tokenizer.tokenize((no_num))]
+        stop_words = set(stopwords.words('english'))
+        words = [word for word in lem if not word in stop_words]
+    return words
 
 
 if __name__ == '__main__':
@@ -52,13 +61,32 @@ if __name__ == '__main__':
     parser.add_argument("input", type=str, help="File path containing content to preprocess.")  # noqa
     parser.add_argument("output", type=str, help="File path at which to output result.")  # noqa
     parser.add_argument("-l", "--lemma", action='store_true', help="Lemmatize clean text")  # noqa
+    parser.add_argument("--metrics", type=str, default=None, help="Export timing metrics as JSON lines to this file path.")  # noqa
+    parser.add_argument("--profile", type=str, default=None, help="Profile the run, writing .pstats and .collapsed files at this path prefix.")  # noqa
     args = parser.parse_args()
 
-    tweets = pd.read_csv(args.input, engine='python', encoding="utf-8")
+    if args.metrics is not None:
+        Metrics.start(args.metrics)
+
+    profiler = Profiler(args.profile)
+    profiler.start()
+
+    with Compression.open(args.input) as f:
+        tweets = pd.read_csv(f, engine='python')
+    profiler.stage('read')
 
     tweets['clean_sentence'] = tweets['tweet_text'].apply(clean)
+    profiler.stage('clean')
 
     if args.lemma:
         tweets['clean_words'] = tweets['clean_sentence'].apply(lem_stop)
+        profiler.stage('lemma')
+
+    with Compression.open(args.output, 'w', newline='') as f:
+        tweets.to_csv(f)
+    profiler.stage('write')
+
+    profiler.stop()
 
-    tweets.to_csv(args.output)
+    if args.metrics is not None:
+        Metrics.stop()
@@ -0,0 +1,165 @@
+import pickle
+import hashlib
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+import utils.records as records
+from utils.compression import Compression
+
+_prime = (1 << 61) - 1
+
+
+class MinHashLSH:
+    ''' Finds near-duplicate documents by MinHash signatures over token shingles, bucketed with banded locality-sensitive hashing. '''
+
+    def __init__(self, permutations: int = 128, bands: int = 32, shingle: int = 3, threshold: float = 0.8, seed: int = 23):
+        if permutations % bands != 0:
+            raise Exception(
+                "Number of permutations must be a multiple of the number of bands.")
+
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self.shingle = shingle
+        self.threshold = threshold
+
+        generator = np.random.RandomState(seed)
+        self._a = generator.randint(1, 1 << 31, size=permutations).astype(np.uint64)
+        self._b = generator.randint(0, 1 << 31, size=permutations).astype(np.uint64)
+
+        self.signatures = np.zeros((0, permutations), dtype=np.uint64)
+        self.records = []
+        self.tables = [{} for _ in range(bands)]
+
+        self._parents = []
+
+    def signature(self, tokens: list):
+        if len(tokens) < self.shingle:
+            shingles = [tuple(tokens)]
+        else:
+            shingles = set(tuple(tokens[i:i + self.shingle])
+                           for i in range(len(tokens) - self.shingle + 1))
+
+        # Stable 32-bit shingle hashes, so signatures survive across processes and runs
+        hashes = np.array([int.from_bytes(hashlib.blake2b('\x1f'.join(s).encode('utf-8'), digest_size=4).digest(), 'little')
+                           for s in shingles], dtype=np.uint64)
+
+        return ((np.outer(hashes, self._a) + self._b) % _prime).min(axis=0)
+
+    def similarity(self, first: int, second: int):
+        return float(np.mean(self.signatures[first] == self.signatures[second]))
+
+    def _find(self, i):
+        while self._parents[i] != i:
+            self._parents[i] = self._parents[self._parents[i]]
+            i = self._parents[i]
+        return i
+
+    def add(self, records: list):
+        ''' Adds (tokens, account, timestamp) records and returns the ids of clusters they joined. '''
+        start = len(self.records)
+
+        signatures = np.array([self.signature(tokens) for tokens, _, _ in records],
+                              dtype=np.uint64).reshape(len(records), self.permutations)
+        self.signatures = np.concatenate([self.signatures, signatures])
+
+        touched = set()
+
+        for offset, (tokens, account, timestamp) in enumerate(records):
+            i = start + offset
+            self.records.append((account, timestamp, ' '.join(tokens)))
+            self._parents.append(i)
+
+            if len(tokens) == 0:
+                continue
+
+            buckets = [table.setdefault(self.signatures[i, band * self.rows:(band + 1) * self.rows].tobytes(), [])
+                       for band, table in enumerate(self.tables)]
+
+            # Each cluster sharing a bucket is scored once, against one of its members
+            candidates = {}
+            for bucket in buckets:
+                for j in bucket:
+                    candidates.setdefault(self._find(j), j)
+
+            for j in candidates.values():
+                if self._find(i) != self._find(j) and self.similarity(i, j) >= self.threshold:
+                    self._parents[self._find(i)] = self._find(j)
+                    touched.add(j)
+
+            if len(candidates) > 0:
+                touched.add(i)
+
+            # Buckets keep one member per cluster, so copies of the same post do not grow them
+            root = self._find(i)
+            for bucket in buckets:
+                if all(self._find(j) != root for j in bucket):
+                    bucket.append(i)
+
+        return set(self._find(i) for i in touched)
+
+    def clusters(self, roots: set = None):
+        ''' Returns clusters of at least two records as lists of (record id, account, timestamp, similarity to the first record). '''
+        members = {}
+        for i in range(len(self.records)):
+            root = self._find(i)
+            if roots is None or root in roots:
+                members.setdefault(root, []).append(i)
+
+        result = []
+        for root, ids in members.items():
+            if len(ids) < 2:
+                continue
+            result.append([(i, self.records[i][0], self.records[i][1], self.similarity(ids[0], i))
+                           for i in ids])
+
+        return result
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            pickle.dump(self.__dict__, f)
+
+    @classmethod
+    def load(cls, path: str):
+        lsh = cls.__new__(cls)
+        with open(path, 'rb') as f:
+            lsh.__dict__.update(pickle.load(f))
+        return lsh
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Detect near-duplicate (coordinated) tweets in preprocessed content.")  # noqa
+    parser.add_argument("input", type=str, nargs='+', help="Preprocessed file paths output by content_filter.py.")  # noqa
+    parser.add_argument("output", type=str, help="File path at which to output candidate clusters.")  # noqa
+    parser.add_argument("--state", type=str, default=None, help="Load and save detector state here, so batches are processed incrementally.")  # noqa
+    parser.add_argument("--threshold", type=float, default=0.8, help="Minimum estimated Jaccard similarity of near-duplicates.")  # noqa
+    parser.add_argument("--shingle", type=int, default=3, help="Number of tokens per shingle.")  # noqa
+    parser.add_argument("--all", action='store_true', help="Output all clusters, not only those joined by this batch.")  # noqa
+    args = parser.parse_args()
+
+    if args.state is not None and os.path.exists(args.state):
+        lsh = MinHashLSH.load(args.state)
+    else:
+        lsh = MinHashLSH(threshold=args.threshold, shingle=args.shingle)
+
+    touched = set()
+    for path in args.input:
+        with Compression.open(path) as f:
+            tweets = pd.read_csv(f, engine='python')
+        touched |= lsh.add([(records.tokens(row), records.value(row['username']), row['timestamp'])
+                            for _, row in tweets.iterrows()])
+
+    clusters = lsh.clusters(None if args.all else touched)
+
+    rows = []
+    for cluster, members in enumerate(clusters):
+        for i, account, timestamp, similarity in members:
+            rows.append([cluster, i, account, timestamp, similarity, lsh.records[i][2]])
+
+    pd.DataFrame(rows, columns=['cluster', 'record', 'username', 'timestamp', 'similarity', 'clean_text']).to_csv(args.output, index=False)  # noqa
+
+    if args.state is not None:
+        lsh.save(args.state)
@@ -0,0 +1,344 @@
+import os
+import json
+import time
+import heapq
+import signal
+import logging
+import argparse
+import threading
+import configparser
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from tweepy_utils import TwitterHarvester
+from utils.credentials import CredentialManager, CredentialPool, Credentials
+from utils.configuration import ConfigurationWatcher
+from data_source import DataSource, DataFilter, DataSieve
+from utils.metrics import Metrics
+from utils.sinks import Sinks, CSVSink, StoreSink
+from utils.store import TweetStore
+
+_metrics = Metrics.scope('daemon')
+_log = logging.getLogger(__name__)
+
+
+class Job:
+    ''' A source, filter and sieve whose selected accounts are polled for new tweets, appended to an output file,
+    a tweet store, or both. '''
+
+    def __init__(self, name: str, source: str, select: str, output: str = None, store: str = None, filter: str = None,
+                 tweet_filter: str = None, interval: float = 900.0, min_interval: float = 60.0, max_interval: float = 21600.0):
+        if output is None and store is None:
+            raise Exception("Job '%s' requires an output file or a tweet store." % name)
+
+        self.name = name
+        self.source = source
+        self.select = DataSieve(string=select)
+        self.filter = DataFilter(string=filter) if filter is not None else None
+        self.tweet_filter = DataFilter(string=tweet_filter) if tweet_filter is not None else None
+        self.output = output
+        self.store = store
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+    @staticmethod
+    def load(path: str):
+        ''' Reads jobs from an INI file: one section per job, with source, select, and output or store, and
+        optionally filter, tweet_filter, interval, min_interval and max_interval in seconds. '''
+        conf = configparser.ConfigParser(interpolation=None)
+        with open(path, 'r', encoding='utf-8') as f:
+            conf.read_file(f)
+
+        jobs = []
+        for section in conf.sections():
+            options = dict(conf[section])
+            for key in ['source', 'select']:
+                if key not in options:
+                    raise Exception("Job '%s' requires option '%s'." % (section, key))
+            for key in ['interval', 'min_interval', 'max_interval']:
+                if key in options:
+                    options[key] = float(options[key])
+            jobs.append(Job(section, **options))
+        return jobs
+
+    def sinks(self, source: DataSource):
+        sinks = Sinks()
+        if self.output is not None:
+            sinks.sinks.append(CSVSink(self.output, append=True))
+        if self.store is not None:
+            store = TweetStore(self.store)
+            store.add_source(source)
+            sinks.sinks.append(StoreSink(store))
+        return sinks
+
+    def accounts(self, source: DataSource):
+        references = source.data["references"]
+        if self.filter is not None:
+            references = self.filter.apply(source.data)
+
+        accounts = []
+        for reference in self.select.apply(references):
+            for label, account in reference["platforms"].get("Twitter", {}).items():
+                accounts.append(account)
+        return accounts
+
+
+class Account:
+    __slots__ = ('handle', 'job', 'interval', 'since_id', 'due', 'polled', 'found', 'errors')
+
+    def __init__(self, handle, job):
+        self.handle = handle
+        self.job = job
+        self.interval = job.interval
+        self.since_id = None
+        self.due = 0.0
+        self.polled = None
+        self.found = None
+        self.errors = 0
+
+    def adapt(self, found: int):
+        ''' Polls active accounts more often and quiet accounts less often, within the job's bounds. '''
+        if found > 0:
+            self.interval = max(self.job.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.job.max_interval, self.interval * 1.5)
+
+
+class Daemon:
+    ''' Keeps sources, credentials and harvesters loaded, polling each job's accounts when they fall due.
+
+    Due accounts wait in a heap ordered by due time; each poll fetches only tweets newer than the last one seen.
+    The newest tweet ID seen per account is saved to the state file with the status, and read back at startup. '''
+
+    def __init__(self, jobs: list, pool: CredentialPool, workers: int = 4, status: str = None, status_interval: float = 10.0,
+                 state: str = None):
+        self.jobs = jobs
+        self.pool = pool
+        self.workers = workers
+        self.status = status
+        self.status_interval = status_interval
+        self.state = state
+
+        # Newest tweet IDs by job and lowercase handle, from the last run
+        self._since = {}
+        if state is not None and os.path.exists(state):
+            with open(state, 'r', encoding='utf-8') as f:
+                self._since = json.load(f)
+
+        self.accounts = {}
+        self.queue = []
+        self._sequence = 0
+
+        self._sources = {}
+        self._sinks = {}
+        self._harvesters = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def _source(self, path):
+        # Sources stay loaded until their file changes
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._sources.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, DataSource(path))
+            self._sources[path] = cached
+        return cached[1]
+
+    def _harvester(self, name):
+        with self._lock:
+            if name not in self._harvesters:
+                self._harvesters[name] = TwitterHarvester()
+                self._harvesters[name].init(self.pool.credentials[name])
+            return self._harvesters[name]
+
+    def _push(self, account):
+        self._sequence += 1
+        heapq.heappush(self.queue, (account.due, self._sequence, account))
+
+    def _scheduled(self, account):
+        return self.accounts.get((account.job.name, account.handle.lower())) is account
+
+    def refresh(self):
+        ''' Schedules accounts newly selected by each job; accounts no longer selected are dropped when next due. '''
+        selected = set()
+        for job in self.jobs:
+            source = self._source(job.source)
+            if job.name not in self._sinks:
+                self._sinks[job.name] = job.sinks(source)
+
+            for handle in job.accounts(source):
+                key = (job.name, handle.lower())
+                selected.add(key)
+                if key not in self.accounts:
+                    self.accounts[key] = Account(handle, job)
+                    self.accounts[key].since_id = self._since.get(job.name, {}).get(handle.lower())
+                    self._push(self.accounts[key])
+
+        for key in set(self.accounts) - selected:
+            del self.accounts[key]
+
+    def poll(self, account):
+        with self.pool.lease(endpoint='timeline') as lease:
+            harvester = self._harvester(lease.name)
+            try:
+                tweets = harvester.collect_user_timeline(account.handle, since_id=account.since_id)
+            except Exception as e:
+                lease.report(status=getattr(getattr(e, 'response', None), 'status_code', None), error=e)
+                raise
+            finally:
+                remaining, reset = harvester.quota('timeline')
+                lease.report(remaining=remaining, reset=reset)
+
+        if len(tweets) > 0:
+            kept = tweets
+            if account.job.tweet_filter is not None:
+                kept = list(account.job.tweet_filter.stream(tweets))
+            if len(kept) > 0:
+                self.write(account.job, kept)
+
+            # Only advanced once the tweets are written, so a failed write fetches them again on the next poll
+            account.since_id = max(tweet.id for tweet in tweets)
+
+        return len(tweets)
+
+    def write(self, job, tweets):
+        self._sinks[job.name].write(tweets)
+
+    def _done(self, account, future):
+        account.polled = time.time()
+
+        try:
+            account.found = future.result()
+            account.errors = 0
+            account.adapt(account.found)
+            _metrics.counter('polls').inc()
+            _metrics.counter('tweets').inc(account.found)
+        except Exception as e:
+            _log.error("Polling account '%s' of job '%s' failed.", account.handle, account.job.name, exc_info=e)
+
+            # Failing accounts back off like quiet ones, so they cannot monopolize the workers
+            account.errors += 1
+            account.interval = min(account.job.max_interval, account.interval * 2)
+            _metrics.counter('errors').inc()
+
+        account.due = time.time() + account.interval
+        if self._scheduled(account):
+            self._push(account)
+
+    def write_state(self):
+        if self.state is None:
+            return
+
+        for account in list(self.accounts.values()):
+            if account.since_id is not None:
+                self._since.setdefault(account.job.name, {})[account.handle.lower()] = account.since_id
+
+        with open(self.state + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self._since, f)
+        os.replace(self.state + '.tmp', self.state)
+
+    def write_status(self):
+        if self.status is None:
+            return
+
+        now = time.time()
+        status = {
+            'time': now,
+            'queued': len(self.queue),
+            'accounts': [{'job': a.job.name, 'handle': a.handle, 'interval': a.interval, 'due_in': a.due - now,
+                          'polled': a.polled, 'found': a.found, 'since_id': a.since_id, 'errors': a.errors}
+                         for a in sorted(self.accounts.values(), key=lambda a: a.due)],
+            'credentials': {name: {'leases': h.leases, 'limits': {endpoint: {'remaining': remaining, 'reset': reset}
+                                                                  for endpoint, (remaining, reset) in h.limits.items()},
+                                   'quarantined': h.quarantined > now, 'unauthorized': h.unauthorized, 'limited': h.limited}
+                            for name, h in self.pool.health.items()},
+            'metrics': Metrics.snapshot()
+        }
+
+        # Write and rename, so readers never see a partial file
+        with open(self.status + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(status, f, indent=2)
+        os.replace(self.status + '.tmp', self.status)
+
+    def run(self):
+        self.refresh()
+
+        running = {}
+        reported = 0.0
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stopped.is_set():
+                now = time.time()
+
+                while len(self.queue) > 0 and self.queue[0][0] <= now and len(running) < self.workers:
+                    _, _, account = heapq.heappop(self.queue)
+                    if not self._scheduled(account):
+                        continue
+                    running[executor.submit(self.poll, account)] = account
+
+                if now - reported >= self.status_interval:
+                    self.refresh()
+                    self.write_status()
+                    self.write_state()
+                    reported = now
+
+                # Sleep until a poll finishes, the next account falls due, or the status is due
+                timeout = self.status_interval
+                if len(self.queue) > 0 and len(running) < self.workers:
+                    timeout = min(timeout, max(0, self.queue[0][0] - now))
+
+                if len(running) > 0:
+                    done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self._done(running.pop(future), future)
+                else:
+                    self._stopped.wait(timeout)
+
+            for future in list(running):
+                self._done(running.pop(future), future)
+
+        for sinks in self._sinks.values():
+            sinks.close()
+
+        self.write_status()
+        self.write_state()
+
+    def stop(self, *args):
+        self._stopped.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Poll sources for new tweets continuously, keeping sources and credentials loaded.")  # noqa
+    parser.add_argument("jobs", type=str, help="INI file with one section per job (source, select, output or store, filter, interval).")  # noqa
+    parser.add_argument("--credentials", type=str, default="./credentials.ini", help="Credential configuration file to use.")  # noqa
+    parser.add_argument("--workers", type=int, default=4, help="Poll this many accounts concurrently.")  # noqa
+    parser.add_argument("--status", type=str, default=None, help="Write scheduler status as JSON to this file path.")  # noqa
+    parser.add_argument("--state", type=str, default=None, help="Save the newest tweet ID per account to this JSON file, and resume from it.")  # noqa
+    parser.add_argument("--config", type=str, default=None, help="Configuration file to apply and watch for changes.")  # noqa
+    parser.add_argument("--metrics", type=str, default=None, help="Export timing metrics as JSON lines to this file path.")  # noqa
+    args = parser.parse_args()
+
+    if args.metrics is not None:
+        Metrics.start(args.metrics)
+
+    watcher = None
+    if args.config is not None:
+        watcher = ConfigurationWatcher(args.config)
+        watcher.start()
+
+    manager = CredentialManager()
+    manager.load_credentials(path=args.credentials)
+
+    daemon = Daemon(Job.load(args.jobs), CredentialPool(manager, 'Twitter', Credentials.OAuthConsumer),
+                    workers=args.workers, status=args.status, state=args.state)
+
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+
+    daemon.run()
+
+    if watcher is not None:
+        watcher.stop()
+
+    if args.metrics is not None:
+        Metrics.stop()
@@ -4,6 +4,9 @@ import re
 
 from utils.configuration import Configurable
 from utils.log import Logging
+from utils.metrics import Metrics
+
+_metrics = Metrics.scope('data')
 
 
 class DataFilter:
@@ -90,13 +93,13 @@ class DataFilter:
                 raise Exception(
                     "Operator value number %d must be a dict." % (i))
 
-            if "$and" in o or "$or" in o:
-                if not len(o) == 1:
+            if "$and" in co or "$or" in co:
+                if not len(co) == 1:
                     raise Exception(
                         "An operator must only contain one of ['$and', '$or'].")
 
                 # Will only execute once as there is only one key
-                for key in o:
+                for key in co:
                     DataFilter._validate_operator(co[key])
             else:
                 try:
@@ -124,8 +127,29 @@ class DataFilter:
         except Exception as e:
             raise Exception("Failed to validate filter: %s" % (e)) from None
 
+    @staticmethod
+    def _resolve(d, key):
+        if key in d:
+            return [d[key]]
+
+        # Dotted keys descend into nested dicts; a list on the path yields one value per element
+        values = [d]
+        for part in key.split('.'):
+            found = []
+            for value in values:
+                if isinstance(value, list):
+                    found += [v[part] for v in value if isinstance(v, dict) and part in v]
+                elif isinstance(value, dict) and part in value:
+                    found.append(value[part])
+            values = found
+        return values
+
     @staticmethod
     def _match_condition(c, d):
+        # A condition on a list matches if any element matches, e.g. a hashtag among a tweet's hashtags
+        if isinstance(d, list):
+            return any(DataFilter._match_condition(c, e) for e in d)
+
         terminal = False
         for key in c:
             if key[0] == '$':
@@ -135,12 +159,15 @@ class DataFilter:
         if not terminal:
             matched = True
             for key in c:
-                if key in d:
-                    matched &= DataFilter._match_condition(c[key], d[key])
-                else:
+                values = DataFilter._resolve(d, key) if isinstance(d, dict) else []
+                if len(values) == 0:
                     return False
+                matched &= any(DataFilter._match_condition(c[key], value) for value in values)
             return matched
 
+        if d is None:
+            return "$eq" in c and c["$eq"] is None
+
         if "$eq" in c:  # "$regex" in c:
             return d == c["$eq"]
         elif "$regex" in c:
@@ -231,16 +258,34 @@ class DataFilter:
                         return True
                 elif DataFilter._match_condition(i, item):
                     return True
+            return False
         else:
             raise Exception(
                 "Unknown operator '%s'. How did this get here?" % (o))
 
+    def match(self, item):
+        for key in self.filter:
+            if self._apply(key, self.filter[key], item):
+                return True
+        return False
+
+    def stream(self, records):
+        ''' Yields the records that match the filter; tweepy models are matched by their JSON, e.g.
+        {"$and": [{"user.followers_count": {"$gte": 1000}}, {"entities.hashtags.text": {"$regex": "(?i)covid"}}]}. '''
+        for record in records:
+            _metrics.counter('stream_items').inc()
+            if self.match(getattr(record, '_json', record)):
+                _metrics.counter('stream_matches').inc()
+                yield record
+
     def apply(self, data):
         items = []
-        for item in data["references"]:
-            for key in self.filter:
-                if self._apply(key, self.filter[key], item):
-                    items.append(item)
+        with _metrics.timer('filter').time():
+            for item in data["references"]:
+                for key in self.filter:
+                    if self._apply(key, self.filter[key], item):
+                        items.append(item)
+        _metrics.counter('filter_items').inc(len(data["references"]))
         return items
 
 
@@ -307,24 +352,32 @@ class DataSieve:
             self.sieve = json
 
     def apply(self, data):
+        with _metrics.timer('sieve').time():
+            result = self._sieve(data)
+        _metrics.counter('sieve_items').inc(len(data))
+        return result
+
+    def _sieve(self, data):
         result = []
         for item in data:
             user = item.copy()
 
-            # Remove extra platform data from item
+            # Build new platform dicts, so sieving never mutates the source data it is applied to
+            platforms = {}
             for platform in user["platforms"]:
                 if not platform in self.sieve.keys():
-                    del user["platforms"][platform]
+                    continue
 
-            for platform in user["platforms"]:
                 labels = [self.sieve[platform]]
                 if isinstance(self.sieve[platform], list):
                     labels = self.sieve[platform]
-                for label in [label for label in user["platforms"][platform]]:
-                    if label not in labels:
-                        del user["platforms"][platform][label]
-                        if len(user["platforms"][platform]) == 0:
-                            del user["platforms"][platform]
+
+                accounts = {label: account for label, account in user["platforms"][platform].items()
+                            if label in labels}
+                if len(accounts) > 0:
+                    platforms[platform] = accounts
+
+            user["platforms"] = platforms
 
             if len(user["platforms"]) > 0:
                 result.append(user)
@@ -381,18 +434,28 @@ class DataSource(Logging, Configurable):
             if not os.path.exists(source):
                 raise Exception("Source path does not exist.")
 
-            with open(source, 'r', encoding='utf-8') as f:
-                raw = f.read()
+            with self.metrics.timer('load').time():
+                with open(source, 'r', encoding='utf-8') as f:
+                    raw = f.read()
 
-            data = json.loads(raw)
+                data = json.loads(raw)
 
-            DataSource.validate_data(data)
+            with self.metrics.timer('validate').time():
+                DataSource.validate_data(data)
 
             self.data = data
         except Exception as e:
             raise Exception(
                 "Failed to load data from source '%s': %s" % ()) from None
 
+    def handles(self, platform: str = 'Twitter'):
+        ''' Maps each lowercase account handle on the platform to its source reference. '''
+        handles = {}
+        for reference in self.data["references"]:
+            for handle in reference.get("platforms", {}).get(platform, {}).values():
+                handles[handle.lower()] = reference
+        return handles
+
     def filter(self, f: DataFilter):
         if not isinstance(f, DataFilter):
             raise Exception(
@@ -0,0 +1,138 @@
+import csv
+import math
+import random
+import argparse
+
+from data_source import DataSource
+import utils.records as records
+from utils.compression import Compression
+from utils.metrics import Metrics
+
+_metrics = Metrics.scope('sampling')
+
+
+class Reservoir:
+    ''' Uniform random sample of up to size items from a stream of unknown length, in memory for size items.
+
+    Uses Algorithm L, which draws how many items to skip before the next replacement, so the random number generator
+    runs about size * log(n / size) times instead of once per item. '''
+
+    def __init__(self, size: int, rng: random.Random):
+        self.size = size
+        self.items = []
+        self.seen = 0
+
+        self._rng = rng
+        self._weight = None
+        self._next = None
+
+    def _draw(self):
+        # 1 - random() is in (0, 1], so its logarithm is always defined
+        return math.log(1.0 - self._rng.random())
+
+    def _skip(self):
+        self._next += int(math.floor(self._draw() / math.log(1.0 - self._weight))) + 1
+
+    def add(self, item):
+        self.seen += 1
+
+        if self.seen <= self.size:
+            self.items.append(item)
+            if self.seen == self.size:
+                self._weight = math.exp(self._draw() / self.size)
+                self._next = self.size
+                self._skip()
+            return
+
+        if self.seen == self._next:
+            self.items[self._rng.randrange(self.size)] = item
+            self._weight *= math.exp(self._draw() / self.size)
+            self._skip()
+
+
+class Sampler:
+    ''' Samples rows in a single pass: uniformly overall, or stratified with a reservoir per stratum.
+
+    Strata are keyed by reference metadata fields of each row's account (e.g. party, state) and by a time bucket
+    format (e.g. '%Y-%m-%d' for a reservoir per day); the same seed and input give the same sample. '''
+
+    def __init__(self, size: int, fields: list = None, bucket: str = None, metadata: dict = None, seed: int = None):
+        self.size = size
+        self.fields = fields if fields is not None else []
+        self.bucket = bucket
+        self.metadata = metadata if metadata is not None else {}
+
+        self.reservoirs = {}
+        self._rng = random.Random(seed)
+        self._index = 0
+
+    def key(self, row):
+        key = []
+        if len(self.fields) > 0:
+            meta = self.metadata.get(str(records.value(row['username'])).lower(), {})
+            key += [meta.get(field) for field in self.fields]
+        if self.bucket is not None:
+            key.append(records.timestamp(row).strftime(self.bucket))
+        return tuple(key)
+
+    def add(self, row):
+        key = self.key(row)
+
+        reservoir = self.reservoirs.get(key)
+        if reservoir is None:
+            reservoir = self.reservoirs[key] = Reservoir(self.size, self._rng)
+
+        # Rows keep their stream position, so the sample can be written in input order
+        reservoir.add((self._index, row))
+        self._index += 1
+
+    def update(self, rows):
+        start = self._index
+        for row in rows:
+            self.add(row)
+        _metrics.counter('rows').inc(self._index - start)
+
+    def sample(self):
+        return [row for _, row in sorted(item for reservoir in self.reservoirs.values() for item in reservoir.items)]
+
+    def strata(self):
+        return {key: (len(reservoir.items), reservoir.seen) for key, reservoir in sorted(self.reservoirs.items(), key=str)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Sample harvested tweets in a single pass, overall or per stratum.")  # noqa
+    parser.add_argument("inputs", type=str, nargs='+', help="Harvested CSV files, compressed or not.")  # noqa
+    parser.add_argument("--output", type=str, required=True, help="Write the sample to this CSV file; .gz and .zst are compressed.")  # noqa
+    parser.add_argument("-n", "--size", type=int, required=True, help="Rows to sample overall, or per stratum.")  # noqa
+    parser.add_argument("--by", type=str, action='append', help="Stratify by this reference metadata field, e.g. party or state.")  # noqa
+    parser.add_argument("--bucket", type=str, default=None, help="Stratify by creation time with this strftime format, e.g. %%Y-%%m-%%d.")  # noqa
+    parser.add_argument("--source", type=str, default=None, help="Source file whose reference metadata --by fields come from.")  # noqa
+    parser.add_argument("--seed", type=int, default=None, help="Seed for a reproducible sample.")  # noqa
+    parser.add_argument("-d", "--debug", action='store_true', help="Print the sampled and seen rows per stratum.")  # noqa
+    args = parser.parse_args()
+
+    if args.by and args.source is None:
+        raise Exception("Stratifying by metadata fields requires a --source file.")
+
+    metadata = {}
+    if args.source is not None:
+        metadata = {handle: reference.get('metadata', {})
+                    for handle, reference in DataSource(args.source).handles().items()}
+
+    sampler = Sampler(args.size, args.by, args.bucket, metadata, args.seed)
+
+    header = None
+    for path in args.inputs:
+        with Compression.open(path, newline='') as f:
+            reader = csv.DictReader(f)
+            header = header or reader.fieldnames
+            sampler.update(reader)
+
+    with Compression.open(args.output, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=header, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(sampler.sample())
+
+    if args.debug:
+        for key, (sampled, seen) in sampler.strata().items():
+            print(key, sampled, seen)
@@ -1,10 +1,16 @@
 import sys
 import argparse
 import csv
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 from tweepy_utils import TwitterHarvester
-from utils.credentials import CredentialManager
+from utils.credentials import CredentialManager, CredentialPool, Credentials
 from data_source import DataSource, DataFilter, DataSieve
+from utils.metrics import Metrics
+from utils.profiling import Profiler
+from utils.sinks import Sinks, CSVSink, StoreSink
+from utils.store import TweetStore
 
 valid_options = {
     "actions": {
@@ -18,17 +24,28 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser("Scrape data for the SSDC project.")  # noqa
     parser.add_argument("--source", type=str, required=True, help="Load this source file.")  # noqa
     parser.add_argument("--select", type=str, required=True, help="Select this reference point for each source item.")  # noqa
-    parser.add_argument("--action", choices=["timeline", "hashtag"], required=True, help="Perform this action on the given sources.")  # noqa
+    parser.add_argument("--action", choices=["timeline", "hashtag", "profiles"], required=True, help="Perform this action on the given sources.")  # noqa
     parser.add_argument("--filter", type=str, help="Filter options to apply to source files.")  # noqa
+    parser.add_argument("--tweet-filter", type=str, help="Only keep harvested tweets matching this filter over tweet fields, e.g. user.followers_count.")  # noqa
     parser.add_argument("--credentials", type=str, default="./credentials.ini", help="Credential configuration file to use.")  # noqa
-    parser.add_argument("--credential-name", type=str, default="twitter-ssdc-consumer", help="Credential configuration file to use.")  # noqa
+    parser.add_argument("--credential-name", type=str, default=None, help="Use only this credential; by default, pool every Twitter OAuth consumer credential.")  # noqa
+    parser.add_argument("--workers", type=int, default=1, help="Harvest this many accounts concurrently, each with a pooled credential.")  # noqa
     parser.add_argument("--option", type=str, action='append', help="Additional options to apply while performing action.")  # noqa
     parser.add_argument("--output", type=str, help="Output result to a single file. (Coming Soon: output different files for each source, entity, etc.)")  # noqa
+    parser.add_argument("--store", type=str, help="Add harvested tweets and the source's reference metadata to this tweet store.")  # noqa
     parser.add_argument("-d", "--debug", action='store_true', help="Print debug output.")  # noqa
     parser.add_argument("-W", "--warnings", action='store_false', help="Disregard warnings.")  # noqa
+    parser.add_argument("--metrics", type=str, default=None, help="Export timing metrics as JSON lines to this file path.")  # noqa
+    parser.add_argument("--profile", type=str, default=None, help="Profile the run, writing .pstats and .collapsed files at this path prefix.")  # noqa
     args = parser.parse_args(sys.argv[1:])
 
-    if (args.output is None and not args.debug) and args.warnings:
+    if args.metrics is not None:
+        Metrics.start(args.metrics)
+
+    profiler = Profiler(args.profile)
+    profiler.start()
+
+    if (args.output is None and args.store is None and not args.debug) and args.warnings:
         raise Exception(
             "You are not redirecting the result either to debug or to an output file. Aborting.")
 
@@ -56,11 +73,29 @@ if __name__ == "__main__":
                         value = valid_options['actions'][args.action][name](
                             value)
 
+    # Parse the tweet filter before harvesting, so an invalid filter fails fast
+    tweet_filter = DataFilter(string=args.tweet_filter) if args.tweet_filter else None
+
     manager = CredentialManager()
     manager.load_credentials(path=args.credentials)
 
-    harvester = TwitterHarvester()
-    harvester.init(manager.credentials[args.credential_name])
+    if args.credential_name is not None:
+        pool = CredentialPool(
+            {args.credential_name: manager.credentials[args.credential_name]})
+    else:
+        pool = CredentialPool(manager, 'Twitter', Credentials.OAuthConsumer)
+
+    harvesters = {}
+    harvesters_lock = threading.Lock()
+
+    def harvester(name):
+        with harvesters_lock:
+            if name not in harvesters:
+                harvesters[name] = TwitterHarvester()
+                harvesters[name].init(pool.credentials[name])
+            return harvesters[name]
+
+    profiler.stage('credentials')
 
     source = DataSource(args.source)
     users = source.data["references"]
@@ -71,32 +106,93 @@ if __name__ == "__main__":
 
     dsieve = DataSieve(string=args.select)
     users = dsieve.apply(users)
+    profiler.stage('source')
 
-    result = None
-
+    accounts = []
     for user in users:
         for platform in user["platforms"]:
             if platform == "Twitter":
                 for label in user["platforms"]["Twitter"]:
-                    if args.action == 'timeline':
-                        if 'limit' in options:
-                            result = harvester.collect_user_timeline(
-                                user["platforms"]["Twitter"][label], limit=options['limit'])
-                        else:
-                            result = harvester.collect_user_timeline(
-                                user["platforms"]["Twitter"][label])
+                    accounts.append(user["platforms"]["Twitter"][label])
+
+    def leased(endpoint, call):
+        with pool.lease(endpoint=endpoint) as lease:
+            h = harvester(lease.name)
+            try:
+                return call(h)
+            except Exception as e:
+                lease.report(status=getattr(getattr(e, 'response', None), 'status_code', None), error=e)
+                raise
+            finally:
+                remaining, reset = h.quota(endpoint)
+                lease.report(remaining=remaining, reset=reset)
+
+    def harvest(account):
+        if args.action == 'timeline':
+            if 'limit' in options:
+                return leased('timeline', lambda h: h.collect_user_timeline(account, limit=options['limit']))
+            return leased('timeline', lambda h: h.collect_user_timeline(account))
+
+    result = None
+
+    if args.action == 'profiles':
+        # Profiles are looked up 100 handles per request, so one lease covers every account
+        result = list(leased('lookup', lambda h: h.lookup_users(accounts)).values())
+    else:
+        harvested = [None] * len(accounts)
+
+        with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+            futures = {executor.submit(harvest, account): i for i, account in enumerate(accounts)}
+
+            # A failing account is logged and skipped, so it never discards what the other accounts harvested
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    harvested[i] = future.result()
+                except Exception as e:
+                    TwitterHarvester.error("Failed to harvest account '%s': %s", accounts[i], e)
+
+        for tweets in harvested:
+            if tweets is not None:
+                if tweet_filter is not None:
+                    tweets = tweet_filter.stream(tweets)
+                if result is None:
+                    result = []
+                result.extend(tweets)
+
+    profiler.stage('harvest')
 
     if result is not None:
-        if args.output is not None:
-            with open(args.output, 'w', encoding='utf-8') as f:
+        if args.action == 'profiles' and args.output is not None:
+            sink = Metrics.scope('sink')
+
+            with sink.timer('write').time(), open(args.output, 'w', encoding='utf-8') as f:
                 w = csv.writer(f)
 
-                w.writerow(['timestamp', 'tweet_text', 'username',
-                            'all_hashtags', 'followers_count', 'location'])
+                w.writerow(['username', 'followers_count', 'friends_count', 'statuses_count', 'location'])
+
+                for user in result:
+                    w.writerow([user.screen_name.encode('utf-8'), user.followers_count, user.friends_count,
+                                user.statuses_count, user.location.encode('utf-8')])
+
+            sink.counter('rows').inc(len(result))
+            profiler.stage('write')
+
+        elif args.output is not None or args.store is not None:
+            sinks = Sinks()
 
-                for tweet in result:
-                    w.writerow([tweet.created_at, tweet.full_text.replace('\n', ' ').encode('utf-8'), tweet.user.screen_name.encode('utf-8'),
-                                [e['text'] for e in tweet._json['entities']['hashtags']], tweet.user.followers_count, tweet.user.location.encode('utf-8')])
+            if args.output is not None:
+                sinks.sinks.append(CSVSink(args.output))
+
+            if args.store is not None:
+                store = TweetStore(args.store)
+                store.add_source(source)
+                sinks.sinks.append(StoreSink(store))
+
+            with sinks:
+                sinks.write(result)
+
+            profiler.stage('write')
 
         if args.debug:
             sample = result
@@ -104,3 +200,8 @@ if __name__ == "__main__":
                 sample = result[:5] + ["..."] + result[-5:]
             for tweet in sample:
                 print(tweet)
+
+    profiler.stop()
+
+    if args.metrics is not None:
+        Metrics.stop()
@@ -0,0 +1,205 @@
+import os
+import pickle
+import hashlib
+import argparse
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from data_source import DataSource
+import utils.records as records
+from utils.compression import Compression
+
+
+class CountMinSketch:
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+
+    def _cells(self, item):
+        # Double hashing derives all row indices from a single 64-bit digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest()
+        first, second = int.from_bytes(digest[:4], 'little'), int.from_bytes(digest[4:], 'little') | 1
+        return [(first + row * second) % self.width for row in range(self.depth)]
+
+    def add(self, item, count: int = 1):
+        self.table[np.arange(self.depth), self._cells(item)] += count
+        self.total += count
+
+    def __getitem__(self, item):
+        return int(self.table[np.arange(self.depth), self._cells(item)].min())
+
+
+class HeavyHitters:
+    ''' Space-saving top-k counter; counts are upper bounds, overestimated by at most the evicted minimum. '''
+
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self.counts = {}
+
+    def add(self, item, count: int = 1):
+        if item in self.counts or len(self.counts) < self.capacity:
+            self.counts[item] = self.counts.get(item, 0) + count
+            return
+
+        smallest = min(self.counts, key=self.counts.get)
+        self.counts[item] = self.counts.pop(smallest) + count
+
+    def most_common(self, n: int = None):
+        return sorted(self.counts.items(), key=lambda item: -item[1])[:n]
+
+
+class BoundedCounter:
+    ''' Heavy hitters of one scope for top-k queries, with point queries answered by a Count-Min sketch shared by
+    every scope, which holds the scope's items under its own prefix. '''
+
+    def __init__(self, sketch: CountMinSketch, scope: str, capacity: int = 100):
+        self.sketch = sketch
+        self.scope = scope
+        self.hitters = HeavyHitters(capacity)
+
+    def update(self, items):
+        for item in items:
+            self.sketch.add(self.scope + item)
+            self.hitters.add(item)
+
+    def __getitem__(self, item):
+        return self.sketch[self.scope + item]
+
+    def most_common(self, n: int = None):
+        return [(item, self[item]) for item, _ in self.hitters.most_common(n)]
+
+
+class TermStatistics:
+    ''' Term and hashtag counts per account, per reference metadata field and per time bucket, updated one batch at a time. '''
+
+    kinds = ['terms', 'hashtags']
+
+    def __init__(self, fields: list = None, bucket: str = '%Y-%m-%d', bounded: bool = False, width: int = 262144, depth: int = 4, capacity: int = 100):
+        self.fields = fields if fields is not None else ['party', 'state', 'chamber']
+        self.bucket = bucket
+        self.bounded = bounded
+        self.width = width
+        self.depth = depth
+        self.capacity = capacity
+
+        self.counters = {}
+        self.buckets = set()
+
+        # Bounded statistics share one sketch per kind across every scope, so their memory stays fixed
+        self.sketches = {kind: CountMinSketch(width, depth) for kind in self.kinds} if bounded else {}
+
+    def _counter(self, key):
+        counter = self.counters.get(key)
+        if counter is None:
+            if self.bounded:
+                kind, dimension, value, bucket = key
+                scope = '%s\x1f%s\x1f%s\x1f' % (dimension, value, bucket)
+                counter = BoundedCounter(self.sketches[kind], scope, self.capacity)
+            else:
+                counter = Counter()
+            self.counters[key] = counter
+        return counter
+
+    def update(self, batch: list, metadata: dict = None):
+        ''' Counts (account, timestamp, terms, hashtags) records; metadata maps lowercase handles to reference metadata. '''
+        metadata = metadata if metadata is not None else {}
+
+        for account, timestamp, terms, hashtags in batch:
+            bucket = timestamp.strftime(self.bucket)
+            self.buckets.add(bucket)
+
+            scopes = [('all', None), ('account', account.lower())]
+            meta = metadata.get(account.lower(), {})
+            scopes += [(field, meta[field]) for field in self.fields if field in meta]
+
+            for kind, items in zip(self.kinds, [terms, hashtags]):
+                for dimension, value in scopes:
+                    self._counter((kind, dimension, value, bucket)).update(items)
+
+    def _merge(self, kind, dimension, value, buckets):
+        if dimension == 'account' and value is not None:
+            value = value.lower()
+
+        total = Counter()
+        for bucket in buckets:
+            counter = self.counters.get((kind, dimension, value, bucket))
+            if counter is not None:
+                total.update(dict(counter.most_common()))
+        return total
+
+    def top(self, kind: str = 'terms', dimension: str = 'all', value: str = None, start: str = None, end: str = None, n: int = 10):
+        buckets = [b for b in self.buckets if (start is None or b >= start) and (end is None or b <= end)]
+        return self._merge(kind, dimension, value, buckets).most_common(n)
+
+    def trending(self, kind: str = 'terms', dimension: str = 'all', value: str = None, bucket: str = None, baseline: int = 7, n: int = 10):
+        ''' Ranks items by their count in a bucket relative to their mean count over the preceding baseline buckets. '''
+        ordered = sorted(self.buckets)
+        if len(ordered) == 0:
+            return []
+
+        bucket = bucket if bucket is not None else ordered[-1]
+        previous = [b for b in ordered if b < bucket][-baseline:]
+
+        current = self._merge(kind, dimension, value, [bucket])
+        past = self._merge(kind, dimension, value, previous)
+
+        scores = {item: count / (1.0 + past[item] / max(1, len(previous)))
+                  for item, count in current.items()}
+
+        return sorted(scores.items(), key=lambda item: -item[1])[:n]
+
+    def save(self, path: str):
+        with open(path, 'wb') as f:
+            pickle.dump(self.__dict__, f)
+
+    @classmethod
+    def load(cls, path: str):
+        statistics = cls.__new__(cls)
+        with open(path, 'rb') as f:
+            statistics.__dict__.update(pickle.load(f))
+        return statistics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Maintain term and hashtag statistics over harvested tweets.")  # noqa
+    parser.add_argument("state", type=str, help="Statistics file to update and query.")  # noqa
+    parser.add_argument("--input", type=str, action='append', help="Harvested or preprocessed file paths to add.")  # noqa
+    parser.add_argument("--source", type=str, help="Source file whose reference metadata is counted per field.")  # noqa
+    parser.add_argument("--bounded", action='store_true', help="Use a shared Count-Min sketch per kind and heavy hitters per scope for new statistics.")  # noqa
+    parser.add_argument("--top", type=str, choices=TermStatistics.kinds, help="Print the most frequent terms or hashtags.")  # noqa
+    parser.add_argument("--trending", type=str, choices=TermStatistics.kinds, help="Print trending terms or hashtags in the latest bucket.")  # noqa
+    parser.add_argument("--dimension", type=str, default='all', help="Restrict queries to 'account' or a metadata field.")  # noqa
+    parser.add_argument("--value", type=str, default=None, help="Value of the restricted dimension.")  # noqa
+    parser.add_argument("-n", type=int, default=10, help="Number of items to print.")  # noqa
+    args = parser.parse_args()
+
+    if os.path.exists(args.state):
+        statistics = TermStatistics.load(args.state)
+    else:
+        statistics = TermStatistics(bounded=args.bounded)
+
+    metadata = {}
+    if args.source is not None:
+        metadata = {handle: reference.get('metadata', {})
+                    for handle, reference in DataSource(args.source).handles().items()}
+
+    for path in args.input or []:
+        with Compression.open(path) as f:
+            tweets = pd.read_csv(f, engine='python')
+        statistics.update([(records.value(row['username']), records.timestamp(row), records.tokens(row), records.hashtags(row))
+                           for _, row in tweets.iterrows()], metadata)
+
+    if args.input:
+        statistics.save(args.state)
+
+    if args.top is not None:
+        for item, count in statistics.top(args.top, args.dimension, args.value, n=args.n):
+            print(count, item)
+
+    if args.trending is not None:
+        for item, score in statistics.trending(args.trending, args.dimension, args.value, n=args.n):
+            print('%.2f' % score, item)
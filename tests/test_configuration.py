@@ -0,0 +1,66 @@
+import unittest
+
+from utils.configuration import Configurable, TriggerableConfiguration
+from utils.log import Logging, _stdout
+from utils.types import strict
+
+
+class Configured(Logging, Configurable):
+    limit = strict(int, 10)
+
+    fired = []
+
+    @classmethod
+    def _limit_trigger(cls, key, old_value, new_value):
+        cls.fired.append((cls, key, old_value, new_value))
+
+    _configurable = TriggerableConfiguration({
+        'default': {
+            **Logging._configurable['default'],
+            'limit': {
+                'type': int
+            }
+        }
+    }, {
+        'limit': [_limit_trigger]
+    })
+
+
+class TestInstanceConfiguration(unittest.TestCase):
+
+    def setUp(self):
+        Configured.fired.clear()
+
+    def test_configure_instance_fires_class_triggers(self):
+        inst = Configured()
+
+        changes = inst.configure(config={'default': {'limit': 20}})
+
+        self.assertEqual(changes, {'limit': (10, 20)})
+        self.assertEqual((inst.limit, Configured.limit), (20, 10))
+        self.assertEqual(Configured.fired, [(Configured, 'limit', 10, 20)])
+
+    def test_configure_instance_rejects_logging_routing(self):
+        inst = Configured()
+
+        with self.assertRaises(KeyError):
+            inst.configure(config={'default': {'debug': False}})
+
+        self.assertTrue(inst.debug)
+        self.assertIn(_stdout, inst.logger.handlers)
+
+    def test_configure_class_routes_logging(self):
+        self.assertIn(_stdout, Configured.logger.handlers)
+
+        changes = Configured.configure(config={'default': {'debug': False}})
+        try:
+            self.assertEqual(changes, {'debug': (True, False)})
+            self.assertNotIn(_stdout, Configured.logger.handlers)
+        finally:
+            Configured.configure(config={'default': {'debug': True}})
+
+        self.assertIn(_stdout, Configured.logger.handlers)
+
+
+if __name__ == '__main__':
+    unittest.main()
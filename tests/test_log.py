@@ -0,0 +1,48 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from utils.configuration import Configurable
+from utils.log import Logging, shutdown
+
+
+class Logged(Logging, Configurable):
+    _configurable = {
+        'default': {
+            **Logging._configurable['default']
+        }
+    }
+
+
+class TestAsynchronousLogging(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'logged.log')
+
+        Logged.debug = False
+        Logged.asynchronous = True
+        Logged.path = self.path
+
+    def tearDown(self):
+        shutdown()
+        Logged.asynchronous = False
+        shutil.rmtree(self.directory)
+
+    def test_log_after_shutdown_restarts_listener(self):
+        Logged.info('before shutdown')
+        shutdown()
+
+        Logged.info('after shutdown')
+        shutdown()
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            content = f.read()
+
+        self.assertIn('before shutdown', content)
+        self.assertIn('after shutdown', content)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,27 +1,61 @@
+import time
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from utils.configuration import Configurable, InstanceConfigurable
 from utils.log import Logging
 from utils.credentials import Credential, Credentials
 import utils.validation as validation
-from utils.uuid import uuidv4
+from utils.uuid import fastid
+from utils.transport import Transport
+from utils.types import strict
 
 import tweepy
 
+_name = validation.compile_string('harvester name', min_len=1, max_len=36)
+
+# Endpoints by the names their rate limits are tracked and pooled under
+_endpoints = {
+    'timeline': 'https://api.twitter.com/1.1/statuses/user_timeline.json',
+    'lookup': 'https://api.twitter.com/1.1/users/lookup.json'
+}
+
 
 class TwitterHarvester(Logging, Configurable):
-    _harvesters = {}
+    profile_ttl = strict(float, 3600.0)
+    lookup_workers = strict(int, 4)
+
+    _configurable = {
+        'default': {
+            **Logging._configurable['default'],
+            'profile_ttl': {
+                'type': float
+            },
+            'lookup_workers': {
+                'type': int
+            }
+        }
+    }
+
+    # Harvesters register weakly, so a harvester nobody uses any more is collected and frees its name
+    _harvesters = weakref.WeakValueDictionary()
+
+    # Profiles by lowercase handle, as (expiry, user), shared by every harvester
+    _profiles = {}
+    _profiles_lock = threading.Lock()
 
     def __init__(self, name: str = None):
         if name is not None:
-            validation.validate_string(
-                name, 'harvester name', min_len=1, max_len=36)
+            _name(name)
 
             if name in TwitterHarvester._harvesters:
                 raise Exception(
                     "Harvester names must be globally unique; cannot instantiate another harvester named '%s'." % name)
         else:
-            name = uuidv4()
+            name = fastid('harvester')
             while name in TwitterHarvester._harvesters:
-                name = uuidv4()
+                name = fastid('harvester')
 
         super(InstanceConfigurable, self).__init__()
 
@@ -30,6 +64,10 @@ class TwitterHarvester(Logging, Configurable):
 
         self._api_init = False
 
+        # Each endpoint has its own rate-limit window, so quotas are kept per endpoint as (remaining, reset), from
+        # the x-rate-limit headers of its latest response
+        self.limits = {}
+
     def init(self, cred: Credential):
         if self._api_init:
             raise Exception(
@@ -42,10 +80,105 @@ class TwitterHarvester(Logging, Configurable):
         auth = tweepy.AppAuthHandler(
             cred.details['key'], cred.details['secret'])
         self.api = tweepy.API(auth_handler=auth, wait_on_rate_limit=True)
+        self.auth = auth.apply_auth()
         self._api_init = True
 
-    def collect_user_timeline(self, user, limit=3200):
+    def quota(self, endpoint: str):
+        ''' Returns the remaining requests and reset time (epoch seconds) last seen for an endpoint, e.g. 'timeline'. '''
+        return self.limits.get(endpoint, (None, None))
+
+    def _get(self, endpoint, **params):
+        response = Transport.get(_endpoints[endpoint], params=params, auth=self.auth)
+
+        if 'x-rate-limit-remaining' in response.headers:
+            self.limits[endpoint] = (int(response.headers['x-rate-limit-remaining']),
+                                     float(response.headers['x-rate-limit-reset']))
+
+        if response.status_code != 200:
+            raise tweepy.TweepError("Twitter request failed with status %d: %s" % (
+                response.status_code, response.text), response)
+
+        return response.json()
+
+    def collect_user_timeline(self, user, limit=3200, since_id=None):
         if limit < 1 or limit > 3200:
             raise Exception("Limit must be greater than 0 and less than 3200.")
 
-        return self.api.user_timeline(user, count=limit, tweet_mode="extended")
+        result = []
+        max_id = None
+
+        # Pages hold at most 200 tweets; each page continues below the oldest tweet of the last
+        while len(result) < limit:
+            params = {'screen_name': user, 'count': min(200, limit - len(result)), 'tweet_mode': 'extended'}
+            if max_id is not None:
+                params['max_id'] = max_id
+            if since_id is not None:
+                params['since_id'] = since_id
+
+            with self.metrics.timer('request').time():
+                page = self._get('timeline', **params)
+
+            if len(page) == 0:
+                break
+
+            result.extend(tweepy.models.Status.parse_list(self.api, page))
+            max_id = page[-1]['id'] - 1
+
+        self.metrics.counter('tweets').inc(len(result))
+
+        return result
+
+    def lookup_users(self, handles: list, ttl: float = None):
+        ''' Returns user profiles by lowercase handle, looked up 100 handles per request and cached for ttl seconds.
+
+        Handles Twitter does not know (suspended, renamed, deleted) are absent from the result. '''
+        ttl = ttl if ttl is not None else self.profile_ttl
+        now = time.time()
+
+        profiles = {}
+        missing = []
+
+        with TwitterHarvester._profiles_lock:
+            for handle in dict.fromkeys(handle.lower() for handle in handles):
+                cached = TwitterHarvester._profiles.get(handle)
+                if cached is not None and cached[0] > now:
+                    profiles[handle] = cached[1]
+                else:
+                    missing.append(handle)
+
+        self.metrics.counter('profile_hits').inc(len(profiles))
+
+        chunks = [missing[i:i + 100] for i in range(0, len(missing), 100)]
+        if len(chunks) == 0:
+            return profiles
+
+        # Never run more requests at once than the lookup quota allows; the transport waits out the rest
+        workers = min(self.lookup_workers, len(chunks))
+        remaining, reset = self.quota('lookup')
+        if remaining is not None and reset > time.time():
+            workers = max(1, min(workers, remaining))
+
+        def lookup(chunk):
+            try:
+                with self.metrics.timer('lookup').time():
+                    return self._get('lookup', screen_name=','.join(chunk), include_entities='false')
+            except tweepy.TweepError as e:
+                # Twitter answers 404 when none of the handles in a chunk exist
+                if e.response is not None and e.response.status_code == 404:
+                    return []
+                raise
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pages = list(executor.map(lookup, chunks))
+
+        expiry = time.time() + ttl
+        with TwitterHarvester._profiles_lock:
+            for page in pages:
+                for user in tweepy.models.User.parse_list(self.api, page):
+                    handle = user.screen_name.lower()
+                    profiles[handle] = user
+                    TwitterHarvester._profiles[handle] = (expiry, user)
+
+        self.metrics.counter('profiles').inc(len(missing))
+
+        return profiles
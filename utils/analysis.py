@@ -1,14 +1,19 @@
 import os
 import sys
 
-import gensim
+import numpy as np
 import matplotlib.pyplot as plt
-from sklearn.manifold import TSNE
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
 
 from utils.configuration import Configurable
+from utils.embeddings import EmbeddingCache
 from utils.log import Logging
-
-model = gensim.models.KeyedVectors.load_word2vec_format('./data/models/GoogleNews-vectors-negative300.bin.gz', binary=True)  # noqa
+from utils.models import ModelRegistry
+from utils.projection import Projection
+from utils.similarity import SimilarityIndex
+from utils.types import strict
 
 
 class PlotEntity:
@@ -21,50 +26,129 @@ class PlotEntity:
 class Analysis(Logging, Configurable):
     ''' TODO: add configurable defaults for plots and mean vector approach '''
 
+    model = strict(str, 'word2vec')
+    density = strict(int, 20000)
+
+    _configurable = {
+        'default': {
+            **Logging._configurable['default'],
+            'model': {
+                'type': str
+            },
+            'density': {
+                'type': int
+            }
+        }
+    }
+
     @classmethod
     def mean_vector(cls, words: list, max_words: int = 100):
-        valid_words = 0
-        vector = None
-
-        for word in words[:min(max_words, len(words))]:
-            if word in model:
-                valid_words += 1
-                if valid_words == 1:
-                    vector = model[word]
-                else:
-                    vector = vector + model[word]
-
-        if valid_words == 0:
+        vectors, counts = cls._mean_vectors([words], max_words)
+
+        if counts[0] == 0:
             raise Exception("No valid words provided for mean vector.")
 
-        return vector / valid_words
+        return vectors[0]
+
+    @classmethod
+    def mean_vectors(cls, documents: list, max_words: int = 100, batch_size: int = 10000, cache: EmbeddingCache = None):
+        ''' Returns an (n_docs, dimensions) float32 array of mean vectors; documents without valid words are zero rows. '''
+        if cache is not None:
+            model = ModelRegistry.fingerprint(cls.model)
+            keys = [EmbeddingCache.key(words, model, max_words)
+                    for words in documents]
+            vectors, found = cache.get(keys)
+
+            missing = np.flatnonzero(~found)
+            if len(missing) == 0:
+                return vectors
+
+            cache.append([keys[i] for i in missing], cls.mean_vectors(
+                [documents[i] for i in missing], max_words, batch_size))
+
+            return cache.get(keys)[0]
+
+        vectors = None
+
+        with cls.metrics.timer('embed').time():
+            for start in range(0, len(documents), batch_size):
+                batch, _ = cls._mean_vectors(
+                    documents[start:start + batch_size], max_words)
+
+                if vectors is None:
+                    vectors = np.empty(
+                        (len(documents), batch.shape[1]), dtype=np.float32)
+                vectors[start:start + len(batch)] = batch
+
+        cls.metrics.counter('documents').inc(len(documents))
+
+        if vectors is None:
+            vectors = np.empty(
+                (0, ModelRegistry.load(cls.model).vector_size), dtype=np.float32)
+
+        return vectors
+
+    @classmethod
+    def _mean_vectors(cls, documents: list, max_words: int):
+        model = ModelRegistry.load(cls.model)
+        index = ModelRegistry.index(cls.model)
+
+        rows = []
+        counts = np.zeros(len(documents), dtype=np.int64)
+
+        for i, words in enumerate(documents):
+            found = [index[word] for word in words[:max_words] if word in index]
+            rows.extend(found)
+            counts[i] = len(found)
+
+        vectors = np.zeros(
+            (len(documents), model.vector_size), dtype=np.float32)
+
+        valid = counts > 0
+        if valid.any():
+            # Rows are grouped by document, so each document's sum is a contiguous segment
+            offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            sums = np.add.reduceat(
+                model.vectors[np.asarray(rows, dtype=np.int64)], offsets[valid], axis=0)
+            vectors[valid] = sums / counts[valid, None]
+
+        return vectors, counts
+
+    @classmethod
+    def similarity_index(cls, documents: list, ids: list, max_words: int = 100, cache: EmbeddingCache = None, method: str = None):
+        vectors = cls.mean_vectors(documents, max_words, cache=cache)
+
+        index = SimilarityIndex(vectors.shape[1], method=method)
+        index.add(ids, vectors)
+
+        return index
 
     @classmethod
     def generate_entities(cls, vectors: list, labels: list):
         if not len(vectors) == len(labels):
             raise Exception("Must provide same number of vectors and labels.")
 
-        tsne_model = TSNE(perplexity=40, n_components=2,
-                          init='pca', n_iter=2500, random_state=23)
+        coordinates = Projection.project(vectors)
 
-        coordinates = tsne_model.fit_transform(vectors)
+        if not np.issubdtype(coordinates.dtype, np.number):
+            raise Exception("Coordinates must be numerical values.")
+        if not all(isinstance(label, str) for label in labels):
+            raise Exception("Labels must be string values.")
 
-        entities = []
-        for xy, label in zip(coordinates, labels):
-            if not isinstance(xy[0], (int, float)):
-                raise Exception("Coordinates must be numerical values.")
-            if not isinstance(label, str):
-                raise Exception("Labels must be string values.")
-            entities.append(PlotEntity(xy[0], xy[1], label))
-
-        return entities
+        return [PlotEntity(x, y, label) for (x, y), label in zip(coordinates.tolist(), labels)]
 
     @classmethod
     def generate_plot(cls, entities, max_plot=100):
+        entities = entities[:min(max_plot, len(entities))]
+
         plt.figure(figsize=(16, 16))
 
-        for entity in entities[:min(max_plot, len(entities))]:
-            plt.scatter(entity.x, entity.y)
+        coordinates = np.array([(entity.x, entity.y) for entity in entities])
+        if len(entities) > 0:
+            plt.scatter(coordinates[:, 0], coordinates[:, 1],
+                        c=np.arange(len(entities)) % 10, cmap='tab10')
+
+        for entity in entities:
             plt.annotate(entity.label,
                          xy=(entity.x, entity.y),
                          xytext=(5, 2),
@@ -73,3 +157,55 @@ class Analysis(Logging, Configurable):
                          va='bottom')
 
         return plt
+
+    @staticmethod
+    def _decimate(coordinates: np.ndarray, max_labels: int, cells: int = 32):
+        # Keep the first point in each cell of a coarse grid, so labels do not pile up in dense regions
+        low = coordinates.min(axis=0)
+        span = np.ptp(coordinates, axis=0)
+        span[span == 0] = 1
+
+        cell = np.floor((coordinates - low) / span * (cells - 1)).astype(np.int64)
+        _, first = np.unique(cell[:, 0] * cells + cell[:, 1], return_index=True)
+
+        return np.sort(first)[:max_labels]
+
+    @classmethod
+    def render(cls, coordinates, labels: list = None, categories: list = None, max_labels: int = 100, path: str = None):
+        ''' Draws all points with a single artist, switching to a density plot above the configured point count. '''
+        coordinates = np.asarray(coordinates, dtype=np.float32)
+
+        figure = Figure(figsize=(16, 16))
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot(1, 1, 1)
+
+        if len(coordinates) > cls.density:
+            collection = axes.hexbin(coordinates[:, 0], coordinates[:, 1],
+                                     gridsize=256, bins='log', mincnt=1, cmap='viridis')
+            figure.colorbar(collection, ax=axes)
+        elif len(coordinates) > 0:
+            colors = None
+            if categories is not None:
+                # Categories index the qualitative palette directly, so each legend entry has its category's color
+                palette = plt.get_cmap('tab20')
+                names, codes = np.unique(np.asarray(categories), return_inverse=True)
+                colors = palette(codes % palette.N)
+            axes.scatter(coordinates[:, 0], coordinates[:, 1], c=colors, s=8, linewidths=0)
+
+            if categories is not None and len(names) <= palette.N:
+                handles = [Line2D([], [], marker='o', linestyle='', color=palette(i)) for i in range(len(names))]
+                axes.legend(handles, names.tolist())
+
+        if labels is not None and len(coordinates) > 0 and max_labels > 0:
+            for i in cls._decimate(coordinates, max_labels):
+                axes.annotate(labels[i],
+                              xy=coordinates[i],
+                              xytext=(5, 2),
+                              textcoords='offset points',
+                              ha='right',
+                              va='bottom')
+
+        if path is not None:
+            figure.savefig(path, dpi=100)
+
+        return figure
@@ -0,0 +1,145 @@
+import io
+import gzip
+import argparse
+
+from utils.configuration import Configurable
+from utils.types import strict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+_magic = {
+    b'\x1f\x8b': 'gzip',
+    b'\x28\xb5\x2f\xfd': 'zstd'
+}
+
+
+class Compression(Configurable):
+    ''' Streaming gzip and zstd compression for harvest files, chosen by the .gz or .zst extension.
+
+    Reads detect the format from the file's leading bytes, so compressed files can be read whatever they are named;
+    zstd files written with a trained dictionary need the same dictionary to be read. '''
+
+    level = strict(int, 3)
+    threads = strict(int, 0)
+    gzip_level = strict(int, 6)
+    dictionary = strict(str, None)
+
+    _configurable = {
+        'default': {
+            'level': {
+                'type': int
+            },
+            'threads': {
+                'type': int
+            },
+            'gzip_level': {
+                'type': int
+            },
+            'dictionary': {
+                'type': str
+            }
+        }
+    }
+
+    _dictionaries = {}
+
+    @classmethod
+    def codec(cls, path: str):
+        if path.endswith('.zst'):
+            return 'zstd'
+        if path.endswith('.gz'):
+            return 'gzip'
+        return None
+
+    @classmethod
+    def sniff(cls, path: str):
+        with open(path, 'rb') as f:
+            head = f.read(4)
+        for magic, codec in _magic.items():
+            if head.startswith(magic):
+                return codec
+        return None
+
+    @classmethod
+    def _zstandard(cls):
+        if zstandard is None:
+            raise Exception("Compression codec 'zstd' requires the zstandard package.")
+        return zstandard
+
+    @classmethod
+    def _dictionary(cls, path):
+        if path is None:
+            return None
+        if path not in cls._dictionaries:
+            with open(path, 'rb') as f:
+                cls._dictionaries[path] = cls._zstandard().ZstdCompressionDict(f.read())
+        return cls._dictionaries[path]
+
+    @classmethod
+    def open(cls, path: str, mode: str = 'r', encoding: str = 'utf-8', newline: str = None, dictionary: str = None):
+        ''' Opens a text file for reading ('r'), writing ('w') or appending ('a'), compressed or not.
+
+        Appending adds a new gzip member or zstd frame, which readers decode as one continuous stream. '''
+        if mode not in ('r', 'w', 'a'):
+            raise Exception("Compressed files open in mode 'r', 'w' or 'a', not '%s'." % mode)
+
+        codec = cls.sniff(path) if mode == 'r' else cls.codec(path)
+        dictionary = cls._dictionary(dictionary if dictionary is not None else cls.dictionary)
+
+        if codec is None:
+            return open(path, mode, encoding=encoding, newline=newline)
+
+        if codec == 'gzip':
+            return gzip.open(path, mode + 't', compresslevel=cls.gzip_level, encoding=encoding, newline=newline)
+
+        zstd = cls._zstandard()
+        if mode == 'r':
+            stream = zstd.ZstdDecompressor(dict_data=dictionary).stream_reader(open(path, 'rb'), closefd=True)
+            return io.TextIOWrapper(io.BufferedReader(stream), encoding=encoding, newline=newline)
+
+        compressor = zstd.ZstdCompressor(level=cls.level, threads=cls.threads, dict_data=dictionary)
+        stream = compressor.stream_writer(open(path, mode + 'b'), closefd=True)
+        return io.TextIOWrapper(stream, encoding=encoding, newline=newline, write_through=True)
+
+    @classmethod
+    def train(cls, paths: list, output: str, size: int = 112640):
+        ''' Trains a zstd dictionary on the lines of sample files, e.g. small per-account harvests. '''
+        samples = []
+        for path in paths:
+            with cls.open(path) as f:
+                samples += [line.encode('utf-8') for line in f]
+
+        dictionary = cls._zstandard().train_dictionary(size, samples)
+        with open(output, 'wb') as f:
+            f.write(dictionary.as_bytes())
+
+        return dictionary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Compress harvest files, or train a zstd dictionary for them.")  # noqa
+    parser.add_argument("command", type=str, choices=['compress', 'train'], help="Compress a file by its output extension, or train a dictionary.")  # noqa
+    parser.add_argument("inputs", type=str, nargs='+', help="Files to compress or to train on.")  # noqa
+    parser.add_argument("--output", type=str, required=True, help="Compressed file or dictionary path.")  # noqa
+    parser.add_argument("--dictionary", type=str, default=None, help="Compress with this trained zstd dictionary.")  # noqa
+    parser.add_argument("--level", type=int, default=None, help="zstd compression level.")  # noqa
+    parser.add_argument("--threads", type=int, default=None, help="zstd compression threads.")  # noqa
+    parser.add_argument("--size", type=int, default=112640, help="Dictionary size in bytes.")  # noqa
+    args = parser.parse_args()
+
+    if args.level is not None:
+        Compression.level = args.level
+    if args.threads is not None:
+        Compression.threads = args.threads
+
+    if args.command == 'train':
+        Compression.train(args.inputs, args.output, args.size)
+    else:
+        with Compression.open(args.output, 'w', newline='', dictionary=args.dictionary) as out:
+            for path in args.inputs:
+                with Compression.open(path, newline='', dictionary=args.dictionary) as f:
+                    for line in f:
+                        out.write(line)
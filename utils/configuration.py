@@ -1,6 +1,10 @@
 from configparser import ConfigParser
+import logging
+import os
 import re
+import threading
 
+from utils.hybrid import hybridmethod
 from utils.types import StrictTypes, _st
 
 
@@ -10,90 +14,159 @@ def _add_trigger(inst, key, trigger):
     inst.triggers[key].append(trigger)
 
 
+def _fire(inst, trigger, key, old_value, new_value):
+    if type(trigger) is classmethod:
+        # Instances fire the class triggers they inherit, bound to their class
+        trigger.__get__(inst, inst if isinstance(inst, type) else type(inst))(key, old_value, new_value)
+    else:
+        trigger(key, old_value, new_value)
+
+
 def _fire_triggers(inst, key, old_value, new_value):
     if key in inst.triggers:
         for trigger in inst.triggers[key]:
-            if type(trigger) is classmethod:
-                trigger.__get__(inst, inst)(key, old_value, new_value)
-            else:
-                trigger(key, old_value, new_value)
+            _fire(inst, trigger, key, old_value, new_value)
 
 
-def _validate(inst, path=None, config=None):
-    parser = None
+def _fire_coalesced(inst, changes):
+    # A trigger registered for several changed keys fires once, for the first of them
+    fired = []
+    for key, (old_value, new_value) in changes.items():
+        for trigger in inst.triggers.get(key, []):
+            if any(trigger is other for other in fired):
+                continue
+            fired.append(trigger)
+
+            _fire(inst, trigger, key, old_value, new_value)
+
+
+def _name(inst):
+    owner = inst if isinstance(inst, type) else type(inst)
+    return '%s.%s' % (owner.__module__, owner.__name__)
+
+
+def _convert(dtype, value):
+    if type(value) is not str or dtype is str:
+        return value
+    if dtype is bool:
+        if value.lower() not in ConfigParser.BOOLEAN_STATES:
+            raise ValueError("Not a boolean: %s" % value)
+        return ConfigParser.BOOLEAN_STATES[value.lower()]
+    return dtype(value)
+
+
+def _read(path):
+    parser = ConfigParser()
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            parser.read_file(f)
+    except OSError as e:
+        raise OSError("Failed to read configuration file %s: %s" % (path, e))
+
+    return {section: dict(parser[section]) for section in parser.sections()}
+
+
+_schemas = {}
+
+
+def _schema(inst):
+    # Each schema compiles once into (type, pattern match) checks per option, instead of being interpreted per value
+    configurable = inst._configurable
+    cached = _schemas.get(id(configurable))
+    if cached is not None and cached[0] is configurable:
+        return cached[1]
+
+    schema = {}
+    for section, options in configurable.items():
+        schema[section] = {}
+        for key, meta in options.items():
+            dtype = meta.get('type')
+            match = re.compile(meta['regex']).match if dtype is str and 'regex' in meta else None
+            schema[section][key] = (dtype, match, meta.get('regex'), meta.get('instance', True))
+
+    _schemas[id(configurable)] = (configurable, schema)
+    return schema
+
 
+def _validate(inst, path=None, config=None):
     if path is not None and config is not None:
         raise ValueError(
-            "Must only provide either config file path or dictionary to configure %s.%s, but not both." % (inst.__module__, inst.__name__))
+            "Must only provide either config file path or dictionary to configure %s, but not both." % _name(inst))
 
     if config is not None and type(config) is not dict:
-        raise ValueError("Invalid value for configuration provided to %s.%s: expected dictionary." % (
-            inst.__module__, inst.__name__))
+        raise ValueError(
+            "Invalid value for configuration provided to %s: expected dictionary." % _name(inst))
 
-    if config is not None:
-        parser = config
-    else:  # if path is not None:
-        parser = ConfigParser()
+    if config is None:
+        config = _read(path)
 
-        try:
-            parser.read(path)
-        except OSError as e:
-            raise OSError("Failed to read configuration file provided to %s.%s: %s" % (
-                inst.__module__, inst.__name__, e))
+    validated = {}
+    location = ' in ' + path if path is not None else ''
+    schema = _schema(inst)
 
-    for section in parser:
+    for section in config:
 
-        if section not in inst._configurable:
+        if section not in schema:
             raise KeyError(
-                "Unknown configuration section %s provided to %s.%s." % (section, inst.__module__, inst.__name__))
+                "Unknown configuration section %s provided to %s%s." % (section, _name(inst), location))
+
+        validated[section] = {}
 
-        for key, value in parser[section].items():
+        for key, value in config[section].items():
 
-            if key not in inst._configurable[section]:
+            if key not in schema[section]:
                 raise KeyError(
-                    "Unknown configuration option %s.%s provided to %s.%s." % (section, key, inst.__module__, inst.__name__))
+                    "Unknown configuration option %s.%s provided to %s%s." % (section, key, _name(inst), location))
 
             if section == 'default' and not hasattr(inst, key):
                 raise KeyError(
-                    "Unknown configuration option %s provided to %s.%s%s." % (key, inst.__module__, inst.__name__, ' in ' + path if path is not None else ''))
+                    "Unknown configuration option %s provided to %s%s." % (key, _name(inst), location))
 
-            meta = inst._configurable[section][key]
+            dtype, match, pattern, instance = schema[section][key]
 
-            if 'type' in meta:
-                dtype = meta['type']
+            if not instance and not isinstance(inst, type):
+                raise KeyError(
+                    "Configuration option %s.%s of %s is shared by all instances and can only be configured on the class%s." % (
+                        section, key, _name(inst), location))
 
+            if dtype is not None:
                 try:
-                    if type(parser) is ConfigParser:
-                        if dtype == bool:
-                            value = parser.getboolean(section, key)
-                        elif dtype == int:
-                            value = parser.getint(section, key)
-                        elif dtype == float:
-                            value = parser.getfloat(section, key)
+                    value = _convert(dtype, value)
+                    if type(value) is not dtype:
+                        raise ValueError(value)
+                except ValueError:
+                    raise ValueError("Invalid value for configuration option %s.%s provided to %s%s: expected %s." % (
+                        section, key, _name(inst), location, dtype.__name__)) from None
 
-                    assert type(value) == meta['type']
-                except ValueError as e:
-                    raise ValueError("Invalid value for configuration option %s.%s provided to %s.%s: expected %s." % (
-                        section, key, inst.__module__, inst.__name__, dtype.__name__))
+                if match is not None and match(value) is None:
+                    raise ValueError("Invalid value for configuration option %s.%s provided to %s%s: must match pattern %s" % (
+                        section, key, _name(inst), location, pattern))
 
-                if dtype == str and 'regex' in meta:
-                    if re.match(meta['regex'], value) is None:
-                        raise ValueError("Invalid value for configuration option %s.%s provided to %s.%s%s: must match pattern %s" % (
-                            section, key, inst.__module__, inst.__name__, ' in ' + path if path is not None else '', meta['regex']))
+            validated[section][key] = value
 
+    return validated
 
-def _configure(inst, path=None, config=None):
-    validated = _validate(inst, path, config)
 
-    to_trigger = {}
+def _apply(inst, validated):
+    changes = {}
+    schema = _schema(inst)
 
     for section in validated:
-        for key in section:
+        for key, value in validated[section].items():
+            # Class-only options in a file applied to instances as well were already applied to their class
+            if not isinstance(inst, type) and not schema[section][key][3]:
+                continue
+
             old_value = None
 
             if section == 'default':
                 old_value = getattr(inst, key)
-                setattr(inst, key, value)
+                if isinstance(inst, type):
+                    # Bypass the watcher, which would fire triggers for every key separately
+                    _st.__setattr__(inst, key, value)
+                else:
+                    setattr(inst, key, value)
             else:
                 if section in inst._config:
                     if key in inst._config[section]:
@@ -103,11 +176,162 @@ def _configure(inst, path=None, config=None):
 
                 inst._config[section][key] = value
 
-            if key in inst.triggers:
-                to_trigger[key] = (old_value, value)
+            if old_value != value:
+                changes[key] = (old_value, value)
+
+    _fire_coalesced(inst, changes)
+
+    return changes
+
+
+def _configure(inst, path=None, config=None):
+    if path is not None:
+        validated = Configuration.load(path).get(
+            inst if isinstance(inst, type) else type(inst), {})
+    else:
+        validated = _validate(inst, config=config)
+
+    return _apply(inst, validated)
+
+
+class Configuration:
+    ''' Parses configuration files once, validating them against every configurable class in a single pass.
+
+    A file holds one [ClassName] section per configured class, plus [ClassName.section] for its other
+    sections; validated results are cached by path and modification time. '''
+
+    _cache = {}
 
-    for key in to_trigger:
-        _fire_triggers(inst, key, *to_trigger[key])
+    @classmethod
+    def load(cls, path: str):
+        path = os.path.abspath(path)
+
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError as e:
+            raise OSError("Failed to read configuration file %s: %s" % (path, e))
+
+        cached = cls._cache.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        classes = {owner.__name__: owner for owner in configurable()}
+
+        grouped = {}
+        for name, options in _read(path).items():
+            owner, _, section = name.partition('.')
+            if owner not in classes:
+                raise KeyError(
+                    "Unknown configurable class %s in configuration file %s." % (owner, path))
+            grouped.setdefault(classes[owner], {})[section or 'default'] = options
+
+        validated = {owner: _validate(owner, config=config)
+                     for owner, config in grouped.items()}
+
+        cls._cache[path] = (mtime, validated)
+
+        return validated
+
+    @classmethod
+    def apply(cls, path: str, *instances):
+        ''' Applies a configuration file to every class it configures, and to the given instances of those classes. '''
+        validated = cls.load(path)
+
+        changes = {}
+        for owner, config in validated.items():
+            changes[owner] = _apply(owner, config)
+
+        for inst in instances:
+            if type(inst) in validated:
+                changes[inst] = _apply(inst, validated[type(inst)])
+
+        return changes
+
+
+class ConfigurationWatcher:
+    ''' Polls configuration files for changes, re-applying only the options whose values changed.
+
+    Each changed object's triggers fire once per reload, however many of its keys changed; options removed from
+    a file keep their current values. '''
+
+    def __init__(self, *paths, interval: float = 2.0, instances: list = None):
+        self.interval = interval
+        self.instances = instances if instances is not None else []
+
+        self._applied = {}
+        self._mtimes = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+        for path in paths:
+            self.watch(path)
+
+    def watch(self, path: str):
+        path = os.path.abspath(path)
+        self._applied[path] = {}
+        self._mtimes[path] = None
+        return self._reload(path)
+
+    def _reload(self, path):
+        self._mtimes[path] = os.stat(path).st_mtime_ns
+        validated = Configuration.load(path)
+
+        previous = self._applied[path]
+        changes = {}
+
+        for owner, config in validated.items():
+            diff = {}
+            for section, options in config.items():
+                before = previous.get(owner, {}).get(section, {})
+                changed = {key: value for key, value in options.items()
+                           if key not in before or before[key] != value}
+                if len(changed) > 0:
+                    diff[section] = changed
+
+            if len(diff) == 0:
+                continue
+
+            changes[owner] = _apply(owner, diff)
+            for inst in self.instances:
+                if type(inst) is owner:
+                    changes[inst] = _apply(inst, diff)
+
+        self._applied[path] = validated
+
+        return changes
+
+    def check(self):
+        ''' Reloads every watched file whose modification time changed; a file that fails to load keeps its last good values. '''
+        changes = {}
+
+        for path in list(self._applied):
+            try:
+                if os.stat(path).st_mtime_ns == self._mtimes[path]:
+                    continue
+                changes.update(self._reload(path))
+            except Exception as e:
+                logging.getLogger(__name__).warning(
+                    "Failed to reload configuration file %s: %s", path, e)
+
+        return changes
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def run():
+            while not self._stopped.wait(self.interval):
+                self.check()
+
+        self._stopped.clear()
+        self._thread = threading.Thread(target=run, name='configuration', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
 
 
 class TriggerableConfiguration:
@@ -136,15 +360,23 @@ class _ClassConfigurableWatcher(_st):
 
         if is_configurable:
             dct['_config'] = {}
-            dct['configure'] = _configure
-            dct['add_trigger'] = _add_trigger
+            dct['configure'] = hybridmethod(_configure)
+            dct['add_trigger'] = hybridmethod(_add_trigger)
+
+            # Class-level triggers are inherited, so configuring a subclass fires its bases' triggers
             dct['triggers'] = {}
+            for base in bases:
+                for key, triggers in getattr(base, 'triggers', {}).items():
+                    inherited = dct['triggers'].setdefault(key, [])
+                    inherited.extend(trigger for trigger in triggers
+                                     if type(trigger) is classmethod and trigger not in inherited)
 
             if '_configurable' in dct:
                 value = dct['_configurable']
                 if type(value) == TriggerableConfiguration:
                     dct['_configurable'] = value.configuration
-                    dct['triggers'] = value.triggers
+                    for key, triggers in value.triggers.items():
+                        dct['triggers'].setdefault(key, []).extend(triggers)
 
         x = super().__new__(cls, name, bases, dct)
 
@@ -183,14 +415,15 @@ class _ConfigurableWatcher(_ClassConfigurableWatcher, _InstanceConfigurableWatch
 
 
 class ClassConfigurable(StrictTypes, metaclass=_ClassConfigurableWatcher):
-    pass
+    __slots__ = ()
 
 
 class InstanceConfigurable(StrictTypes, metaclass=_InstanceConfigurableWatcher):
+    __slots__ = ()
 
     def __init__(self):
         if self.__class__ in _InstanceConfigurableWatcher.instance_configurable:
-            self._configurable = {}
+            self._configurable = getattr(self.__class__, '_configurable', {})
             self._config = {}
             self.triggers = {}
 
@@ -204,7 +437,7 @@ class InstanceConfigurable(StrictTypes, metaclass=_InstanceConfigurableWatcher):
 
 
 class Configurable(ClassConfigurable, InstanceConfigurable, StrictTypes, metaclass=_ConfigurableWatcher):
-    pass
+    __slots__ = ()
 
 
 def configurable_classes():
@@ -3,11 +3,17 @@ from typing import Union, IO
 import secrets
 import os
 import configparser
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import contextmanager
 
 from utils.configuration import Configurable
 from utils.log import Logging
+from utils.metrics import Metrics
 from utils.hybrid import hybridmethod
-from utils.uuid import uuidv4
+from utils.uuid import fastid
 import utils.validation as validation
 
 
@@ -19,14 +25,23 @@ class CredentialManager:
     pass
 
 
+_platform = validation.compile_string('credential platform', re.compile(f'^{validation.regex.partial.basics}+$'))
+_endpoint = validation.compile_string('credential endpoint')
+_format_name = validation.compile_string('credential format name', re.compile(
+    f'^{validation.regex.partial.basics}{{1,32}}$'), min_len=1, max_len=32)
+_format_path = validation.compile_string('credential format path name',
+                                         validation.regex.complete.snakes, min_len=1, max_len=32)
+_domain = validation.compile_string('credential domain', validation.regex.complete.lowdot)
+_name = validation.compile_string('credential name', validation.regex.complete.kebabs, min_len=1, max_len=36)
+
+
 class Credential:
 
     def __init__(self, platform: str, domain: str, endpoint: str, format: CredentialFormat, register: bool = True, **details):
-        validation.validate_string(platform, 'credential platform', regex=re.compile(
-            f'^{validation.regex.partial.basics}+$'))
+        _platform(platform)
 
         # TODO: add endpoint URI validation
-        validation.validate_string(endpoint, 'credential endpoint')
+        _endpoint(endpoint)
 
         format.validate(**details)
 
@@ -37,7 +52,8 @@ class Credential:
 
         self.domain = CredentialManager.domain(domain)
         if register:
-            self.domain.register(self)
+            # The caller owns a credential it constructs, so its domain only refers to it weakly
+            self.domain.register(self, weak=True)
 
 
 class CredentialFormat:
@@ -45,19 +61,15 @@ class CredentialFormat:
     _cf = {}
 
     @classmethod
-    def _validate_details(cls, **details):
-        # TODO: validate that details meet format requirements, else throw exception
-        pass
+    def _validate_details(cls, path, **details):
+        # Compiling the field schema validates it, and gives the validator for every credential of the format
+        return validation.compile_fields(details, 'credential format %s' % path)
 
     def __init__(self, name: str, pathname: str = None, parent: CredentialFormat = None, **details):
-        validation.validate_string(name, 'credential format name', min_len=1,
-                                   max_len=32, regex=re.compile(f'^{validation.regex.partial.basics}{{1,32}}$'))
+        _format_name(name)
 
         if pathname is not None:
-            validation.validate_string(pathname, 'credential format path name',
-                                       regex=validation.regex.complete.snakes, min_len=1, max_len=32)
-
-        self._validate_details(**details)
+            _format_path(pathname)
 
         self.id = CredentialFormat._id
         CredentialFormat._id += 1
@@ -76,6 +88,9 @@ class CredentialFormat:
         if self.path in CredentialFormat._cf:
             raise Exception(
                 "Credential format must generate a globally unique path; '%s' already defined." % self.path)
+
+        self._validator = self._validate_details(self.path, **details)
+
         CredentialFormat._cf[self.path] = self
 
         self.details = details
@@ -84,14 +99,7 @@ class CredentialFormat:
         return Credential(platform, domain, endpoint, self, **kwargs)
 
     def validate(self, **kwargs):
-        for key in kwargs:
-            if key not in self.details:
-                raise Exception(
-                    "Unknown field '%s' for credential format %s." % (key, self.path))
-        for key in self.details:
-            if not key in kwargs:
-                raise Exception(
-                    "Missing required field '%s' for credential format %s." % (key, self.path))
+        self._validator(kwargs)
 
     @classmethod
     def format(cls, path):
@@ -122,24 +130,33 @@ class Credentials:
 
 class CredentialDomain:
     def __init__(self, domain: str):
-        validation.validate_string(
-            domain, 'credential domain', regex=validation.regex.complete.lowdot)
+        _domain(domain)
         self.domain = domain
-        self.credentials = {}
 
-    def register(self, credential: Union[Credential, CredentialFormat], name: str = None, *properties, **details):
+        # Credentials the domain built or loaded stay registered; credentials owned elsewhere only while their owner
+        # still uses them
+        self.owned = {}
+        self.borrowed = weakref.WeakValueDictionary()
+
+    @property
+    def credentials(self):
+        return {**self.borrowed, **self.owned}
+
+    def register(self, credential: Union[Credential, CredentialFormat], name: str = None, *properties, weak: bool = False, **details):
+        ''' Registers a credential, or builds one from a format, and returns its name.
+
+        Credentials are held strongly unless weak is set for an existing credential its caller keeps alive. '''
         if name is not None:
-            validation.validate_string(
-                name, 'credential name', regex=validation.regex.complete.kebabs, min_len=1, max_len=36)
+            _name(name)
 
-            if name in self.credentials:
-                if credential != self.credentials[name]:
-                    raise Exception("Cannot register multiple credentials of the same name for the same domain; %s already has credential '%s'." % (
-                        self.domain, name))
+            registered = self.credentials.get(name)
+            if registered is not None and credential != registered:
+                raise Exception("Cannot register multiple credentials of the same name for the same domain; %s already has credential '%s'." % (
+                    self.domain, name))
         else:
-            name = uuidv4()
-            while name in self.credentials:
-                name = uuidv4()
+            name = fastid('credential')
+            while name in self.borrowed or name in self.owned:
+                name = fastid('credential')
 
         if isinstance(credential, Credential):
             if len(properties) != 0 or len(details) != 0:
@@ -153,9 +170,15 @@ class CredentialDomain:
                 raise Exception(
                     "Cannot register a new credential with no details. (required for %s: %s.)" % (credential.path, ','.join(credential.details.keys())))
             credential = Credential(
-                *properties, credential, **details)
+                *properties, credential, register=False, **details)
+            weak = False
 
-        self.credentials[name] = credential
+        if weak:
+            self.borrowed[name] = credential
+        else:
+            self.owned[name] = credential
+
+        return name
 
 
 class CredentialManager:
@@ -172,17 +195,16 @@ class CredentialManager:
 
     def register(self, credential: Union[CredentialFormat, Credential], name: str = None, *properties, **details):
         if name is not None:
-            validation.validate_string(
-                name, 'credential name', regex=validation.regex.complete.kebabs, min_len=1, max_len=36)
+            _name(name)
 
             if name in self.credentials:
                 if credential != self.credentials[name]:
                     raise Exception(
                         "Cannot register multiple credentials of the same name in the same manager; already have '%s'.)" % name)
         else:
-            name = uuidv4()
+            name = fastid('credential')
             while name in self.credentials:
-                name = uuidv4()
+                name = fastid('credential')
 
         if isinstance(credential, Credential):
             if len(properties) != 0 or len(details) != 0:
@@ -199,7 +221,11 @@ class CredentialManager:
                 *properties, credential, register=False, **details)
 
         self.credentials[name] = credential
-        credential.domain.register(credential, name)
+
+        # The manager keeps its credentials alive, so the domain refers to them weakly, by the same name
+        credential.domain.register(credential, name, weak=True)
+
+        return name
 
     @hybridmethod
     def load_credentials(self, file: IO = None, path: str = None):
@@ -256,3 +282,162 @@ class CredentialManager:
                     self.register(credential, name=name)
         except Exception as e:
             raise Exception("Failed to load credentials: %s" % e) from None
+
+
+class CredentialHealth:
+    ''' Usage and failure record of one pooled credential, with its rate-limit quota per endpoint. '''
+
+    def __init__(self):
+        self.leases = 0
+        self.errors = deque()
+        self.unauthorized = 0
+        self.limited = 0
+        self.failures = 0
+        self.quarantined = 0.0
+
+        # Each endpoint has its own rate-limit window, as (remaining, reset)
+        self.limits = {}
+
+    def quota(self, endpoint: str):
+        return self.limits.get(endpoint, (None, None))
+
+    def available(self, now: float, endpoint: str = None):
+        if self.quarantined > now:
+            return False
+        # An exhausted quota is unavailable for its endpoint until its window resets
+        remaining, reset = self.quota(endpoint)
+        return remaining is None or remaining > 0 or reset is None or reset <= now
+
+
+class CredentialPool:
+    ''' Hands out the least-loaded healthy credential of a platform and format, quarantining failing credentials with exponential backoff.
+
+    Leases may name the endpoint they call; rate limits are tracked per credential and endpoint, so a credential
+    whose quota for one endpoint is exhausted is still handed out for the others. '''
+
+    _metrics = Metrics.scope('credentials')
+
+    def __init__(self, source: Union[CredentialManager, CredentialDomain, dict], platform: str = None, format: CredentialFormat = None,
+                 backoff: float = 60.0, max_backoff: float = 3600.0, window: float = 300.0, max_errors: int = 5):
+        if isinstance(format, str):
+            format = CredentialFormat.format(format)
+
+        credentials = source if isinstance(source, dict) else source.credentials
+        self.credentials = {name: credential for name, credential in credentials.items()
+                            if (platform is None or credential.platform == platform)
+                            and (format is None or format in credential.format.ancestry)}
+
+        if len(self.credentials) == 0:
+            raise Exception("No credentials for platform %s and format %s to pool." % (
+                platform, format.path if format is not None else None))
+
+        self.health = {name: CredentialHealth() for name in self.credentials}
+
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.window = window
+        self.max_errors = max_errors
+
+        self._condition = threading.Condition()
+
+    def _select(self, now, endpoint):
+        healthy = [name for name, health in self.health.items() if health.available(now, endpoint)]
+        if len(healthy) == 0:
+            return None
+        return min(healthy, key=lambda name: (self.health[name].leases, -(self.health[name].quota(endpoint)[0] or 0)))
+
+    def checkout(self, timeout: float = None, endpoint: str = None):
+        ''' Returns the name and credential of the least-loaded credential healthy for an endpoint, waiting up to timeout seconds for one. '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self._condition:
+            while True:
+                now = time.time()
+                name = self._select(now, endpoint)
+                if name is not None:
+                    self.health[name].leases += 1
+                    self._metrics.counter('checkouts').inc()
+                    return name, self.credentials[name]
+
+                # Wake when the earliest quarantine or quota window ends, or when a credential is checked in
+                resets = [h.quota(endpoint)[1] for h in self.health.values()]
+                wake = [h.quarantined for h in self.health.values() if h.quarantined > now] + \
+                    [reset for reset in resets if reset is not None and reset > now]
+                wait = min(wake) - now if len(wake) > 0 else None
+
+                if deadline is not None:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        raise Exception("No healthy credential became available within %.1f seconds." % timeout)
+                    wait = left if wait is None else min(wait, left)
+
+                self._condition.wait(wait)
+
+    def checkin(self, name: str, status: int = None, error: Exception = None, remaining: int = None, reset: float = None,
+                endpoint: str = None):
+        ''' Returns a credential with the outcome of its use: an HTTP status, an error, and the endpoint's quota left until
+        reset (epoch seconds). '''
+        with self._condition:
+            health = self.health[name]
+            health.leases -= 1
+            now = time.time()
+
+            if remaining is not None:
+                health.limits[endpoint] = (remaining, reset)
+
+            while len(health.errors) > 0 and health.errors[0] < now - self.window:
+                health.errors.popleft()
+
+            if status == 429:
+                # Rate limits only hold back the endpoint, until its window resets, or for the backoff without one
+                health.limited += 1
+                reset = health.quota(endpoint)[1]
+                if reset is None or reset <= now:
+                    reset = now + self.backoff
+                health.limits[endpoint] = (0, reset)
+                self._metrics.counter('limited').inc()
+            elif error is not None or (status is not None and status >= 400):
+                if status == 401:
+                    health.unauthorized += 1
+
+                health.errors.append(now)
+                health.failures += 1
+
+                if status == 401 or len(health.errors) >= self.max_errors:
+                    health.quarantined = now + min(self.max_backoff,
+                                                   self.backoff * 2 ** (health.failures - 1))
+
+                if health.quarantined > now:
+                    self._metrics.counter('quarantines').inc()
+            else:
+                health.failures = 0
+
+            self._condition.notify_all()
+
+    @contextmanager
+    def lease(self, timeout: float = None, endpoint: str = None):
+        ''' Checks out a credential for calls to an endpoint for the duration of a block; the block may call report()
+        on the lease before it ends. '''
+        name, credential = self.checkout(timeout, endpoint)
+        outcome = {'endpoint': endpoint}
+
+        lease = CredentialLease(name, credential, outcome)
+        try:
+            yield lease
+        except Exception as e:
+            outcome.setdefault('error', e)
+            raise
+        finally:
+            self.checkin(name, **outcome)
+
+
+class CredentialLease:
+    def __init__(self, name: str, credential: Credential, outcome: dict):
+        self.name = name
+        self.credential = credential
+        self._outcome = outcome
+
+    def report(self, status: int = None, error: Exception = None, remaining: int = None, reset: float = None):
+        for key, value in [('status', status), ('error', error), ('remaining', remaining), ('reset', reset)]:
+            if value is not None:
+                self._outcome[key] = value
@@ -0,0 +1,187 @@
+import os
+import json
+import hashlib
+import argparse
+
+import numpy as np
+
+from utils.configuration import Configurable
+from utils.types import strict
+
+
+class EmbeddingCache(Configurable):
+    ''' Content-addressed store of mean vectors, backed by a memory-mapped float32 matrix and a file of row keys.
+
+    Rows are only ever appended, so a single writer per directory is assumed; compact() rewrites the store. '''
+
+    directory = strict(str, './data/embeddings')
+
+    _configurable = {
+        'default': {
+            'directory': {
+                'type': str
+            }
+        }
+    }
+
+    _key_size = hashlib.sha1().digest_size
+
+    @staticmethod
+    def key(tokens: list, model: str, max_words: int):
+        ''' Keys the mean vector of tokens; model identifies the vectors themselves, e.g. ModelRegistry.fingerprint(name),
+        so that vectors cached for an older model source are never returned. '''
+        digest = hashlib.sha1()
+        digest.update(('%s\0%d\0' % (model, max_words)).encode('utf-8'))
+        digest.update('\x1f'.join(tokens).encode('utf-8'))
+        return digest.digest()
+
+    def __init__(self, directory: str = None, dimensions: int = None):
+        self.root = directory if directory is not None else EmbeddingCache.directory
+        self.dimensions = dimensions
+
+        os.makedirs(self.root, exist_ok=True)
+
+        meta = self._file('meta.json')
+        if os.path.exists(meta):
+            with open(meta, 'r', encoding='utf-8') as f:
+                stored = json.load(f)['dimensions']
+
+            if dimensions is not None and dimensions != stored:
+                raise Exception("Embedding cache at '%s' holds %d-dimensional vectors, not %d." % (
+                    self.root, stored, dimensions))
+            self.dimensions = stored
+
+        self._load()
+
+    def _file(self, name):
+        return os.path.join(self.root, name)
+
+    def _load(self):
+        self.keys = {}
+        self.rows = 0
+        self._matrix = None
+
+        if not os.path.exists(self._file('keys.bin')):
+            return
+
+        with open(self._file('keys.bin'), 'rb') as f:
+            raw = f.read()
+
+        count = len(raw) // self._key_size
+        if self.dimensions is not None and os.path.exists(self._file('vectors.f32')):
+            # A crash between writing vectors and keys leaves extra rows, which are ignored
+            rows = os.path.getsize(self._file('vectors.f32')) // (4 * self.dimensions)
+            count = min(count, rows)
+
+        for row in range(count):
+            self.keys[raw[row * self._key_size:(row + 1) * self._key_size]] = row
+        self.rows = count
+
+    def _vectors(self):
+        if self._matrix is None or len(self._matrix) < self.rows:
+            self._matrix = np.memmap(self._file('vectors.f32'), dtype=np.float32,
+                                     mode='r', shape=(self.rows, self.dimensions))
+
+        return self._matrix
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def get(self, keys: list):
+        ''' Returns the cached vectors for the given keys and a boolean mask of the keys that were found. '''
+        found = np.array([key in self.keys for key in keys], dtype=bool)
+
+        vectors = np.zeros((len(keys), self.dimensions or 0), dtype=np.float32)
+        if found.any():
+            rows = np.array([self.keys[key] for key, hit in zip(keys, found) if hit], dtype=np.int64)
+            vectors[found] = self._vectors()[rows]
+
+        return vectors, found
+
+    def append(self, keys: list, vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        if len(keys) != len(vectors):
+            raise Exception("Must provide same number of keys and vectors.")
+
+        if self.dimensions is None:
+            self.dimensions = vectors.shape[1]
+            with open(self._file('meta.json'), 'w', encoding='utf-8') as f:
+                json.dump({'dimensions': self.dimensions}, f)
+        elif vectors.shape[1] != self.dimensions:
+            raise Exception("Embedding cache holds %d-dimensional vectors, not %d." % (
+                self.dimensions, vectors.shape[1]))
+
+        new = []
+        seen = set()
+        for i, key in enumerate(keys):
+            if key not in self.keys and key not in seen:
+                seen.add(key)
+                new.append(i)
+
+        if len(new) == 0:
+            return
+
+        row = self.rows
+
+        # Vectors are written before keys, so a key never refers to a missing row
+        with open(self._file('vectors.f32'), 'ab') as f:
+            f.truncate(row * 4 * self.dimensions)
+            f.write(vectors[new].tobytes())
+
+        with open(self._file('keys.bin'), 'ab') as f:
+            f.truncate(row * self._key_size)
+            f.write(b''.join(keys[i] for i in new))
+
+        for i in new:
+            self.keys[keys[i]] = row
+            row += 1
+        self.rows = row
+
+    def compact(self, keep: set = None, max_entries: int = None):
+        ''' Rewrites the store, keeping only the given keys and at most the newest max_entries rows. '''
+        rows = sorted(self.keys.items(), key=lambda item: item[1])
+
+        if keep is not None:
+            rows = [item for item in rows if item[0] in keep]
+        if max_entries is not None:
+            rows = rows[max(0, len(rows) - max_entries):]
+
+        evicted = len(self.keys) - len(rows)
+
+        if len(rows) > 0:
+            vectors = self._vectors()[np.array([row for _, row in rows], dtype=np.int64)]
+        else:
+            vectors = np.zeros((0, self.dimensions or 0), dtype=np.float32)
+
+        self._matrix = None
+
+        with open(self._file('vectors.f32.tmp'), 'wb') as f:
+            f.write(np.ascontiguousarray(vectors).tobytes())
+        with open(self._file('keys.bin.tmp'), 'wb') as f:
+            f.write(b''.join(key for key, _ in rows))
+
+        os.replace(self._file('vectors.f32.tmp'), self._file('vectors.f32'))
+        os.replace(self._file('keys.bin.tmp'), self._file('keys.bin'))
+
+        self._load()
+
+        return evicted
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Manage a persistent embedding cache.")  # noqa
+    parser.add_argument("command", choices=["stats", "compact"], help="Print cache statistics, or compact the cache.")  # noqa
+    parser.add_argument("--directory", type=str, default=None, help="Cache directory (defaults to the configured directory).")  # noqa
+    parser.add_argument("--max-entries", type=int, default=None, help="Evict the oldest entries beyond this many while compacting.")  # noqa
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.directory)
+
+    if args.command == 'compact':
+        print("Evicted %d entries." % cache.compact(max_entries=args.max_entries))
+
+    print("%d entries of %s dimensions in %s." % (len(cache), cache.dimensions, cache.root))
@@ -1,16 +1,34 @@
 import logging
+import logging.handlers
+import queue
+import threading
+import atexit
 import time
 from datetime import datetime
 import random
 import sys
-from functools import partial
 
 from utils.configuration import Configurable, TriggerableConfiguration
+from utils.hybrid import hybridmethod
+from utils.metrics import Metrics
 from utils.types import strict
 
 _stdout = logging.StreamHandler(sys.stdout)
 _sttime = time.time()
 
+_formatter = logging.Formatter(
+    fmt='{asctime} [{levelname:1.1s}] {message}',
+    style='{',
+    datefmt='%c'
+)
+
+_handlers = {}
+_loggers = {}
+_scopes = {}
+
+_listener = None
+_lock = threading.RLock()
+
 
 def _path(log_path, key, uuid):
     if '$key' in log_path:
@@ -47,75 +65,194 @@ def _path(log_path, key, uuid):
     return log_path
 
 
+class _Listener(logging.handlers.QueueListener):
+    def handle(self, record):
+        for handler in record.targets:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def enqueue_sentinel(self):
+        # Always block, so the sentinel is never dropped from a full queue
+        self.queue.put(self._sentinel)
+
+
+class _AsyncHandler(logging.handlers.QueueHandler):
+    ''' Hands records to the single background listener thread, which writes them to this handler's targets. '''
+
+    dropped = 0
+
+    def __init__(self, targets: list):
+        # The queue is looked up per record, so records after shutdown() go to the listener it restarts
+        super().__init__(None)
+        self.targets = targets
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.targets = self.targets
+        return record
+
+    def enqueue(self, record):
+        listener = _listener
+        records = listener.queue if listener is not None else _listen()
+
+        if Logging.overflow == 'drop':
+            try:
+                records.put_nowait(record)
+            except queue.Full:
+                _AsyncHandler.dropped += 1
+        else:
+            records.put(record)
+
+
+def _listen():
+    global _listener
+
+    with _lock:
+        if _listener is None:
+            _listener = _Listener(queue.Queue(maxsize=Logging.queue_size))
+            _listener.start()
+            atexit.register(shutdown)
+
+        return _listener.queue
+
+
+def shutdown():
+    ''' Writes out all queued records and stops the background listener; later records start a new one. '''
+    global _listener
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _handler(filename):
+    # File handlers are shared by every logger writing to the same file
+    handler = _handlers.get(filename)
+    if handler is None:
+        handler = logging.FileHandler(filename=filename, delay=True)
+        handler.formatter = _formatter
+        _handlers[filename] = handler
+    return handler
+
+
+def _attach(owner, logger):
+    targets = []
+    if owner.path is not None:
+        targets.append(_handler(_path(owner.path, owner.key, id(Logging))))
+    if owner.debug:
+        targets.append(_stdout)
+
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    if owner.asynchronous:
+        logger.addHandler(_AsyncHandler(targets))
+    else:
+        for handler in targets:
+            logger.addHandler(handler)
+
+
+def _logger(owner):
+    logger = _loggers.get(owner)
+    if logger is not None:
+        return logger
+
+    with _lock:
+        if owner not in _loggers:
+            logger = logging.getLogger(owner.__name__)
+            logger.setLevel(logging.DEBUG)
+            _attach(owner, logger)
+            _loggers[owner] = logger
+        return _loggers[owner]
+
+
+class _LoggerDescriptor:
+    def __get__(self, instance, owner):
+        return _logger(owner)
+
+
+class _MetricsDescriptor:
+    def __get__(self, instance, owner):
+        scope = _scopes.get(owner)
+        if scope is None:
+            scope = _scopes.setdefault(owner, Metrics.scope(owner.__name__.lower()))
+        return scope
+
+
+def _method(level):
+    @hybridmethod
+    def log(self, content, *args):
+        logger = _logger(self if isinstance(self, type) else type(self))
+        # Arguments are only formatted into the message once the level is known to be enabled
+        if logger.isEnabledFor(level):
+            logger._log(level, content, args)
+    return log
+
+
 class Logging(Configurable):
+    __slots__ = ()
+
     debug = strict(bool, True)
     path = strict(str, None)
     key = strict(str, None)
+    asynchronous = strict(bool, False)
+    queue_size = strict(int, 10000)
+    overflow = strict(str, 'block')
+
+    logger = _LoggerDescriptor()
+    metrics = _MetricsDescriptor()
 
-    _configurable = {
+    debugging = _method(logging.DEBUG)
+    info = _method(logging.INFO)
+    warn = _method(logging.WARN)
+    error = _method(logging.ERROR)
+    critical = _method(logging.CRITICAL)
+
+    @classmethod
+    def _route_trigger(cls, *args):
+        with _lock:
+            for owner, logger in _loggers.items():
+                if issubclass(owner, cls):
+                    _attach(owner, logger)
+
+    _configurable = TriggerableConfiguration({
+        # Loggers and their handlers belong to classes, so routing options cannot be configured per instance
         'default': {
             'debug': {
-                'type': bool
+                'type': bool,
+                'instance': False
             },
             'path': {
-                'type': str
+                'type': str,
+                'instance': False
             },
             'key': {
                 'type': str,
-                'regex': '^(num|hex)(0?[1-9]|[1-2][0-9]|3[0-2])$'
+                'regex': '^(num|hex)(0?[1-9]|[1-2][0-9]|3[0-2])$',
+                'instance': False
+            },
+            'asynchronous': {
+                'type': bool,
+                'instance': False
+            },
+            'queue_size': {
+                'type': int,
+                'instance': False
+            },
+            'overflow': {
+                'type': str,
+                'regex': '^(block|drop)$',
+                'instance': False
             }
         }
-    }
-
-    def __init__(self, level=logging.DEBUG):
-        def log(level, content):
-            self.logger.log(level, content)
-
-        for (name, level) in [
-            ('debugging', logging.DEBUG),
-            ('info', logging.INFO),
-            ('warn', logging.WARN),
-            ('error', logging.ERROR),
-            ('critical', logging.CRITICAL)
-        ]:
-            setattr(self, name, partial(log, level))
-
-        self.logger = logging.getLogger(self.__class__.__name__)
-        self.logger.setLevel(level)
-
-        self.formatter = logging.Formatter(
-            fmt='{asctime} [{levelname:1.1s}] {message}',
-            style='{',
-            datefmt='%c'
-        )
-
-        self.handler = logging.FileHandler(
-            filename=_path(self.path, self.key, id(Logging)),
-            delay=True
-        )
-
-        self.handler.formatter = self.formatter
-        self.logger.addHandler(self.handler)
-        self.logger.addHandler(_stdout)
-
-        self.add_trigger('key', self._path_trigger)
-        self.add_trigger('path', self._path_trigger)
-        self.add_trigger('debug', self._debug_trigger)
-
-    def _path_trigger(self, *args):
-        self.logger.removeHandler(self.handler)
-
-        self.handler = logging.FileHandler(
-            filename=_path(self.path, self.key, id(Logging)),
-            delay=True
-        )
-
-        self.handler.formatter = self.formatter
-
-        self.logger.addHandler(self.handler)
-
-    def _debug_trigger(self, *args):
-        if self.debug and _stdout not in self.logger.handlers:
-            self.logger.addHandler(_stdout)
-        elif not self.debug and _stdout in self.logger.handlers:
-            self.logger.removeHandler(_stdout)
+    }, {
+        'debug': [_route_trigger],
+        'path': [_route_trigger],
+        'key': [_route_trigger],
+        'asynchronous': [_route_trigger]
+    })
+
+    def __init__(self, level=None):
+        if level is not None:
+            self.logger.setLevel(level)
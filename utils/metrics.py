@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import bisect
+import threading
+
+from utils.configuration import Configurable
+from utils.types import strict
+
+_bounds = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60]
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, bounds: list = None):
+        self.bounds = bounds if bounds is not None else _bounds
+        self.buckets = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        return {'count': self.count, 'sum': self.sum, 'buckets': list(self.buckets)}
+
+
+class _Timing:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Timer(Histogram):
+    ''' Histogram of durations in seconds; use time() as a context manager around the timed code. '''
+
+    def time(self):
+        return _Timing(self)
+
+
+class _Null:
+    ''' Stands in for every metric while metrics are disabled, so instrumented code does no work. '''
+
+    def inc(self, amount=1):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+_null = _Null()
+
+
+class Scope:
+    ''' Prefixes metric names, so each subsystem registers its metrics under its own name. '''
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+
+    def counter(self, name: str):
+        return Metrics.counter('%s_%s' % (self.prefix, name)) if Metrics.enabled else _null
+
+    def histogram(self, name: str):
+        return Metrics.histogram('%s_%s' % (self.prefix, name)) if Metrics.enabled else _null
+
+    def timer(self, name: str):
+        return Metrics.timer('%s_%s' % (self.prefix, name)) if Metrics.enabled else _null
+
+
+class Metrics(Configurable):
+    enabled = strict(bool, False)
+    interval = strict(int, 60)
+    json_path = strict(str, None)
+    prometheus_path = strict(str, None)
+
+    _configurable = {
+        'default': {
+            'enabled': {
+                'type': bool
+            },
+            'interval': {
+                'type': int
+            },
+            'json_path': {
+                'type': str
+            },
+            'prometheus_path': {
+                'type': str
+            }
+        }
+    }
+
+    _metrics = {}
+    _lock = threading.Lock()
+    _exporter = None
+    _stopped = threading.Event()
+
+    @classmethod
+    def _get(cls, name, kind):
+        metric = cls._metrics.get(name)
+        if metric is None:
+            with cls._lock:
+                metric = cls._metrics.setdefault(name, kind())
+        if type(metric) is not kind:
+            raise Exception("Metric '%s' is already registered as a %s." % (name, metric.kind))
+        return metric
+
+    @classmethod
+    def counter(cls, name: str):
+        return cls._get(name, Counter)
+
+    @classmethod
+    def histogram(cls, name: str):
+        return cls._get(name, Histogram)
+
+    @classmethod
+    def timer(cls, name: str):
+        return cls._get(name, Timer)
+
+    @classmethod
+    def scope(cls, prefix: str):
+        return Scope(prefix)
+
+    @classmethod
+    def snapshot(cls):
+        with cls._lock:
+            metrics = list(cls._metrics.items())
+        return {name: metric.snapshot() for name, metric in sorted(metrics)}
+
+    @classmethod
+    def export(cls):
+        snapshot = cls.snapshot()
+
+        if cls.json_path is not None:
+            with open(cls.json_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'time': time.time(), 'metrics': snapshot}) + '\n')
+
+        if cls.prometheus_path is not None:
+            with cls._lock:
+                metrics = sorted(cls._metrics.items())
+
+            lines = []
+            for name, metric in metrics:
+                lines.append('# TYPE %s %s' % (name, metric.kind if metric.kind == 'counter' else 'histogram'))
+                if metric.kind == 'counter':
+                    lines.append('%s %s' % (name, metric.value))
+                    continue
+
+                cumulative = 0
+                for bound, count in zip(metric.bounds + ['+Inf'], metric.buckets):
+                    cumulative += count
+                    lines.append('%s_bucket{le="%s"} %d' % (name, bound, cumulative))
+                lines.append('%s_sum %f' % (name, metric.sum))
+                lines.append('%s_count %d' % (name, metric.count))
+
+            # Write and rename, so scrapers never read a partial file
+            with open(cls.prometheus_path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.replace(cls.prometheus_path + '.tmp', cls.prometheus_path)
+
+    @classmethod
+    def start(cls, path: str = None):
+        ''' Enables metrics and exports them every interval seconds from a background thread until stop().
+
+        A path sets both exports: JSON lines at the path, and Prometheus text next to it with a .prom extension. '''
+        if path is not None:
+            cls.json_path = path
+            cls.prometheus_path = os.path.splitext(path)[0] + '.prom'
+
+        cls.enabled = True
+
+        if cls._exporter is not None:
+            return
+
+        def run():
+            while not cls._stopped.wait(cls.interval):
+                cls.export()
+
+        cls._stopped.clear()
+        cls._exporter = threading.Thread(target=run, name='metrics', daemon=True)
+        cls._exporter.start()
+
+    @classmethod
+    def stop(cls):
+        if cls._exporter is not None:
+            cls._stopped.set()
+            cls._exporter.join()
+            cls._exporter = None
+
+        cls.export()
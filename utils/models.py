@@ -0,0 +1,176 @@
+import os
+import glob
+import json
+import argparse
+import threading
+
+import gensim
+
+from utils.configuration import Configurable, TriggerableConfiguration
+from utils.types import strict
+
+
+class ModelRegistry(Configurable):
+    ''' Lazily loads word vector models, converting them once to gensim's native format so that they can be memory-mapped.
+
+    Native models record the path, size and modification time of the source they were converted from, and are
+    converted again when the source no longer matches. '''
+
+    directory = strict(str, './data/models')
+    word2vec = strict(str, './data/models/GoogleNews-vectors-negative300.bin.gz')
+
+    _sources = {
+        'word2vec': None
+    }
+
+    _models = {}
+    _indices = {}
+    _fingerprints = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def _source_trigger(cls, key, old_value, new_value):
+        with cls._lock:
+            cls._models.pop(key, None)
+            cls._indices.pop(key, None)
+            cls._fingerprints.pop(key, None)
+
+    _configurable = TriggerableConfiguration({
+        'default': {
+            'directory': {
+                'type': str
+            },
+            'word2vec': {
+                'type': str
+            }
+        }
+    }, {
+        'word2vec': [_source_trigger]
+    })
+
+    @classmethod
+    def register(cls, name: str, source: str):
+        if name in cls._sources:
+            raise Exception("Model '%s' is already registered." % name)
+
+        cls._sources[name] = source
+
+    @classmethod
+    def source(cls, name: str):
+        if name not in cls._sources:
+            raise Exception("Unknown model '%s'." % name)
+
+        # Models registered without a source read their path from configuration
+        source = cls._sources[name]
+        return source if source is not None else getattr(cls, name)
+
+    @classmethod
+    def native(cls, name: str):
+        return os.path.join(cls.directory, '%s.kv' % name)
+
+    @staticmethod
+    def _stat(source):
+        stat = os.stat(source)
+        return {'source': os.path.abspath(source), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    @staticmethod
+    def _converted(native):
+        try:
+            with open(native + '.json', 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def convert(cls, name: str, force: bool = False):
+        source = cls.source(name)
+        native = cls.native(name)
+
+        if not force and os.path.exists(native):
+            # Without its source, a native model is used as it is
+            if not os.path.exists(source) or cls._converted(native) == cls._stat(source):
+                return native
+
+        if not os.path.exists(source):
+            raise Exception("Model source '%s' does not exist." % source)
+
+        model = gensim.models.KeyedVectors.load_word2vec_format(
+            source, binary=source.endswith(('.bin', '.bin.gz')))
+
+        os.makedirs(os.path.dirname(native) or '.', exist_ok=True)
+
+        # Save under a temporary name and move into place, so concurrent workers never map a partial file
+        temporary = '%s.%d.tmp' % (native, os.getpid())
+        model.save(temporary, sep_limit=0)
+
+        for array in glob.glob(glob.escape(temporary) + '.*.npy'):
+            os.replace(array, native + array[len(temporary):])
+        os.replace(temporary, native)
+
+        # Recorded last, so an interrupted conversion never looks up to date
+        with open(temporary + '.json', 'w', encoding='utf-8') as f:
+            json.dump(cls._stat(source), f)
+        os.replace(temporary + '.json', native + '.json')
+
+        return native
+
+    @classmethod
+    def load(cls, name: str = 'word2vec'):
+        model = cls._models.get(name)
+        if model is not None:
+            return model
+
+        with cls._lock:
+            if name not in cls._models:
+                native = cls.convert(name)
+                cls._models[name] = gensim.models.KeyedVectors.load(
+                    native, mmap='r')
+
+                # Recorded with the model, so the fingerprint always describes the vectors in use
+                converted = cls._converted(native)
+                cls._fingerprints[name] = json.dumps(converted, sort_keys=True) if converted is not None else native
+            return cls._models[name]
+
+    @classmethod
+    def fingerprint(cls, name: str = 'word2vec'):
+        ''' Identifies the source of a model's loaded vectors, e.g. to key cached embeddings of the model. '''
+        cls.load(name)
+        return cls._fingerprints[name]
+
+    @classmethod
+    def index(cls, name: str = 'word2vec'):
+        index = cls._indices.get(name)
+        if index is not None:
+            return index
+
+        model = cls.load(name)
+
+        with cls._lock:
+            if name not in cls._indices:
+                index = getattr(model, 'key_to_index', None)
+                if index is None:
+                    index = {word: vocab.index for word, vocab in model.vocab.items()}
+                cls._indices[name] = index
+            return cls._indices[name]
+
+    @classmethod
+    def unload(cls, name: str = None):
+        with cls._lock:
+            if name is None:
+                cls._models.clear()
+                cls._indices.clear()
+                cls._fingerprints.clear()
+            else:
+                cls._models.pop(name, None)
+                cls._indices.pop(name, None)
+                cls._fingerprints.pop(name, None)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Convert word vector models to memory-mappable native format.")  # noqa
+    parser.add_argument("models", type=str, nargs='*', default=['word2vec'], help="Registered model names to convert.")  # noqa
+    parser.add_argument("-f", "--force", action='store_true', help="Convert even if an up-to-date native model exists.")  # noqa
+    args = parser.parse_args()
+
+    for name in args.models:
+        print(ModelRegistry.convert(name, force=args.force))
@@ -0,0 +1,110 @@
+import sys
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from collections import Counter
+
+
+class Profiler:
+    ''' Profiles a job with cProfile and a stack sampler, tracking memory growth between named stages.
+
+    Writes <path>.pstats and <path>.collapsed (one "frame;frame;frame count" line per stack, for flame graphs);
+    constructed without a path, every method does nothing. '''
+
+    def __init__(self, path: str = None, interval: float = 0.005, top: int = 20):
+        self.path = path
+        self.interval = interval
+        self.top = top
+
+        self.stages = []
+        self.samples = Counter()
+
+        self._profile = None
+        self._sampler = None
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self):
+        if self.path is None:
+            return
+
+        tracemalloc.start()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._time = time.perf_counter()
+
+        self._target = threading.get_ident()
+        self._sampler = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._sampler.start()
+
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+
+            stack = []
+            while frame is not None:
+                stack.append('%s:%s' % (frame.f_code.co_filename, frame.f_code.co_name))
+                frame = frame.f_back
+
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def stage(self, name: str):
+        ''' Ends the current stage, recording its duration and the allocations that grew during it. '''
+        if self.path is None:
+            return
+
+        elapsed = time.perf_counter() - self._time
+
+        # Keep snapshot bookkeeping out of both the profile and the stage timings
+        self._profile.disable()
+
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        growth = snapshot.compare_to(self._snapshot, 'lineno')
+        self.stages.append((name, elapsed, current, peak, growth[:self.top]))
+
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self._snapshot = snapshot
+
+        self._profile.enable()
+        self._time = time.perf_counter()
+
+    def stop(self):
+        if self.path is None or self._profile is None:
+            return
+
+        self._profile.disable()
+        self._stopped.set()
+        self._sampler.join()
+
+        self._profile.dump_stats(self.path + '.pstats')
+        with open(self.path + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write('%s %d\n' % (stack, count))
+
+        tracemalloc.stop()
+        self._profile = None
+
+        self.summary()
+
+    def summary(self, stream=sys.stderr):
+        stats = pstats.Stats(self.path + '.pstats', stream=stream)
+        stats.sort_stats('cumulative').print_stats(self.top)
+
+        for name, elapsed, current, peak, growth in self.stages:
+            print("Stage '%s': %.3fs, %.1f MiB traced (peak %.1f MiB)" % (
+                name, elapsed, current / 2**20, peak / 2**20), file=stream)
+            for stat in growth:
+                if stat.size_diff > 0:
+                    print("    %s" % stat, file=stream)
@@ -0,0 +1,146 @@
+import numpy as np
+from sklearn.decomposition import PCA
+from sklearn.manifold import TSNE
+from sklearn.neighbors import NearestNeighbors
+from threadpoolctl import threadpool_limits
+
+from utils.configuration import Configurable
+from utils.types import strict
+
+
+def _tsne(method):
+    def fit(vectors, projection):
+        model = TSNE(perplexity=projection.perplexity, n_components=2, init='pca', method=method,
+                     n_iter=projection.iterations, random_state=projection.seed, n_jobs=projection.threads)
+        return model.fit_transform(vectors), None
+    return fit
+
+
+def _fft(vectors, projection):
+    try:
+        import openTSNE
+    except ImportError:
+        raise Exception(
+            "Projection method 'fft' requires the openTSNE package.") from None
+
+    model = openTSNE.TSNE(perplexity=projection.perplexity, n_iter=projection.iterations, n_jobs=projection.threads,
+                          negative_gradient_method='fft', random_state=projection.seed)
+    embedding = model.fit(vectors)
+    return np.asarray(embedding), lambda rest: np.asarray(embedding.transform(rest))
+
+
+def _umap(vectors, projection):
+    try:
+        import umap
+    except ImportError:
+        raise Exception(
+            "Projection method 'umap' requires the umap-learn package.") from None
+
+    model = umap.UMAP(n_components=2, n_neighbors=projection.neighbours,
+                      random_state=projection.seed, n_jobs=projection.threads)
+    return model.fit_transform(vectors), model.transform
+
+
+class Projection(Configurable):
+    ''' Projects vectors to two dimensions for plotting, optionally fitting on a sample and placing the remaining points afterwards. '''
+
+    method = strict(str, 'tsne')
+    components = strict(int, 50)
+    sample = strict(int, 0)
+    neighbours = strict(int, 10)
+    threads = strict(int, 1)
+    perplexity = strict(float, 40.0)
+    iterations = strict(int, 2500)
+    seed = strict(int, 23)
+
+    _configurable = {
+        'default': {
+            'method': {
+                'type': str,
+                'regex': '^[a-z_]+$'
+            },
+            'components': {
+                'type': int
+            },
+            'sample': {
+                'type': int
+            },
+            'neighbours': {
+                'type': int
+            },
+            'threads': {
+                'type': int
+            },
+            'perplexity': {
+                'type': float
+            },
+            'iterations': {
+                'type': int
+            },
+            'seed': {
+                'type': int
+            }
+        }
+    }
+
+    _methods = {
+        'exact': _tsne('exact'),
+        'tsne': _tsne('barnes_hut'),
+        'fft': _fft,
+        'umap': _umap
+    }
+
+    @classmethod
+    def register(cls, name: str, fit):
+        ''' Registers a projection method; fit(vectors, projection) returns coordinates and an optional transform for new points. '''
+        if name in cls._methods:
+            raise Exception("Projection method '%s' is already registered." % name)
+
+        cls._methods[name] = fit
+
+    @classmethod
+    def project(cls, vectors, method: str = None):
+        method = method if method is not None else cls.method
+        if method not in cls._methods:
+            raise Exception("Unknown projection method '%s'. Must be one of %s." % (
+                method, list(cls._methods.keys())))
+
+        vectors = np.asarray(vectors, dtype=np.float32)
+
+        with threadpool_limits(limits=cls.threads):
+            if 0 < cls.components < min(vectors.shape):
+                vectors = PCA(n_components=cls.components,
+                              random_state=cls.seed).fit_transform(vectors)
+
+            if cls.sample <= 0 or cls.sample >= len(vectors):
+                coordinates, _ = cls._methods[method](vectors, cls)
+                return coordinates
+
+            fitted = np.random.RandomState(cls.seed).choice(
+                len(vectors), cls.sample, replace=False)
+            rest = np.setdiff1d(np.arange(len(vectors)), fitted)
+
+            sampled, transform = cls._methods[method](vectors[fitted], cls)
+
+            coordinates = np.empty((len(vectors), 2), dtype=np.float32)
+            coordinates[fitted] = sampled
+
+            if transform is not None:
+                coordinates[rest] = transform(vectors[rest])
+            else:
+                coordinates[rest] = cls._interpolate(
+                    vectors[fitted], coordinates[fitted], vectors[rest])
+
+            return coordinates
+
+    @classmethod
+    def _interpolate(cls, fitted, coordinates, rest):
+        # Place each remaining point at the inverse-distance weighted mean of its nearest fitted neighbours
+        neighbours = NearestNeighbors(n_neighbors=min(cls.neighbours, len(fitted)),
+                                      n_jobs=cls.threads).fit(fitted)
+        distances, indices = neighbours.kneighbors(rest)
+
+        weights = 1.0 / np.maximum(distances, 1e-12)
+        weights /= weights.sum(axis=1, keepdims=True)
+
+        return np.einsum('ij,ijk->ik', weights, coordinates[indices])
@@ -0,0 +1,31 @@
+import ast
+import re
+from datetime import datetime
+
+
+def value(field):
+    # The harvest writers store encoded text as bytes literals, e.g. b'SenTuberville'
+    if isinstance(field, str) and field[:2] in ("b'", 'b"'):
+        try:
+            return ast.literal_eval(field).decode('utf-8')
+        except (ValueError, SyntaxError):
+            pass
+    return field
+
+
+def tokens(row):
+    if 'clean_words' in row and isinstance(row['clean_words'], str):
+        return ast.literal_eval(row['clean_words'])
+    if 'clean_sentence' in row and isinstance(row['clean_sentence'], str):
+        return row['clean_sentence'].split()
+    return re.findall(r'\w+', str(value(row['tweet_text'])).lower())
+
+
+def hashtags(row):
+    if isinstance(row['all_hashtags'], str):
+        return [tag.lower() for tag in ast.literal_eval(row['all_hashtags'])]
+    return []
+
+
+def timestamp(row):
+    return datetime.fromisoformat(str(row['timestamp']))
@@ -0,0 +1,292 @@
+import time
+import argparse
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from utils.configuration import Configurable
+from utils.types import strict
+
+
+def _normalize(vectors):
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _top(scores, k):
+    k = min(k, scores.shape[-1])
+    top = np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=-1), axis=-1)
+    return np.take_along_axis(top, order, axis=-1)
+
+
+class SimilarityIndex(Configurable):
+    ''' Cosine similarity search over mean vectors, either by exact scan or through an inverted file of k-means lists.
+
+    The lists are trained once the index holds min_train vectors, and trained again whenever it has grown by the
+    retrain factor since, so that they keep following the data; until then queries scan exactly. '''
+
+    method = strict(str, 'auto')
+    exact_limit = strict(int, 50000)
+    lists = strict(int, 0)
+    probes = strict(int, 8)
+    seed = strict(int, 23)
+    min_train = strict(int, 4096)
+    retrain = strict(float, 2.0)
+    max_scores = strict(int, 1 << 25)
+
+    _configurable = {
+        'default': {
+            'method': {
+                'type': str,
+                'regex': '^(auto|exact|ivf)$'
+            },
+            'exact_limit': {
+                'type': int
+            },
+            'lists': {
+                'type': int
+            },
+            'probes': {
+                'type': int
+            },
+            'seed': {
+                'type': int
+            },
+            'min_train': {
+                'type': int
+            },
+            'retrain': {
+                'type': float
+            },
+            'max_scores': {
+                'type': int
+            }
+        }
+    }
+
+    def __init__(self, dimensions: int, method: str = None):
+        method = method if method is not None else SimilarityIndex.method
+        if method not in ['auto', 'exact', 'ivf']:
+            raise Exception(
+                "Similarity index method must be one of ['auto', 'exact', 'ivf'].")
+
+        self.dimensions = dimensions
+        self.kind = method
+
+        self.size = 0
+        self._vectors = np.zeros((0, dimensions), dtype=np.float32)
+        self._ids = np.zeros(0, dtype=np.int64)
+
+        self.centroids = None
+        self.trained = 0
+        self._assignments = np.zeros(0, dtype=np.int64)
+        self._order = None
+        self._bounds = None
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def vectors(self):
+        return self._vectors[:self.size]
+
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    def _reserve(self, count):
+        if self.size + count <= len(self._vectors):
+            return
+
+        # Grow geometrically so that repeated inserts stay amortized O(1) per vector
+        capacity = max(self.size + count, 2 * len(self._vectors), 1024)
+
+        vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+        vectors[:self.size] = self.vectors
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self.size] = self.ids
+        assignments = np.zeros(capacity, dtype=np.int64)
+        assignments[:self.size] = self._assignments[:self.size]
+
+        self._vectors, self._ids, self._assignments = vectors, ids, assignments
+
+    def add(self, ids, vectors):
+        vectors = _normalize(vectors)
+        ids = np.asarray(ids, dtype=np.int64)
+
+        if len(ids) != len(vectors):
+            raise Exception("Must provide same number of ids and vectors.")
+        if vectors.shape[1] != self.dimensions:
+            raise Exception("Similarity index holds %d-dimensional vectors, not %d." % (
+                self.dimensions, vectors.shape[1]))
+
+        self._reserve(len(ids))
+
+        self._vectors[self.size:self.size + len(ids)] = vectors
+        self._ids[self.size:self.size + len(ids)] = ids
+        if self.centroids is not None:
+            self._assignments[self.size:self.size + len(ids)] = np.argmax(
+                vectors @ self.centroids.T, axis=1)
+            self._order = None
+
+        self.size += len(ids)
+
+        if self._stale():
+            self.train()
+
+    @property
+    def approximate(self):
+        return self.kind == 'ivf' or (self.kind == 'auto' and self.size > SimilarityIndex.exact_limit)
+
+    def _stale(self):
+        if not self.approximate or self.size < SimilarityIndex.min_train:
+            return False
+        # A retrain factor of 1 or less keeps the first lists however far the index grows
+        return self.centroids is None or (SimilarityIndex.retrain > 1 and self.size >= SimilarityIndex.retrain * self.trained)
+
+    def train(self):
+        lists = SimilarityIndex.lists if SimilarityIndex.lists > 0 else int(4 * np.sqrt(self.size))
+        lists = max(1, min(lists, self.size))
+
+        kmeans = MiniBatchKMeans(n_clusters=lists, random_state=SimilarityIndex.seed,
+                                 batch_size=max(1024, 4 * lists))
+        kmeans.fit(self.vectors)
+
+        self.centroids = _normalize(kmeans.cluster_centers_)
+        self._assignments[:self.size] = np.argmax(
+            self.vectors @ self.centroids.T, axis=1)
+        self._order = None
+        self.trained = self.size
+
+    def _lists(self):
+        if self._order is None:
+            assignments = self._assignments[:self.size]
+            self._order = np.argsort(assignments, kind='stable')
+            self._bounds = np.searchsorted(
+                assignments[self._order], np.arange(len(self.centroids) + 1))
+        return self._order, self._bounds
+
+    def query(self, vectors, k: int = 10, exact: bool = False):
+        ''' Returns the ids and cosine similarities of the k most similar vectors for each query vector. '''
+        queries = _normalize(vectors)
+
+        if self.size == 0:
+            return np.zeros((len(queries), 0), dtype=np.int64), np.zeros((len(queries), 0), dtype=np.float32)
+
+        if exact or self.centroids is None:
+            k = min(k, self.size)
+            ids = np.empty((len(queries), k), dtype=np.int64)
+            similarities = np.empty((len(queries), k), dtype=np.float32)
+
+            # Queries are scanned in batches, so the score matrix never holds more than max_scores entries
+            batch = max(1, SimilarityIndex.max_scores // self.size)
+            for start in range(0, len(queries), batch):
+                scores = queries[start:start + batch] @ self.vectors.T
+                top = _top(scores, k)
+                ids[start:start + len(top)] = self.ids[top]
+                similarities[start:start + len(top)] = np.take_along_axis(scores, top, axis=1)
+
+            return ids, similarities
+
+        order, bounds = self._lists()
+        probes = _top(queries @ self.centroids.T, SimilarityIndex.probes)
+
+        k = min(k, self.size)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+
+        for i, query in enumerate(queries):
+            candidates = np.concatenate(
+                [order[bounds[p]:bounds[p + 1]] for p in probes[i]])
+            if len(candidates) == 0:
+                continue
+
+            scores = self._vectors[candidates] @ query
+            top = _top(scores, k)
+            ids[i, :len(top)] = self._ids[candidates[top]]
+            similarities[i, :len(top)] = scores[top]
+
+        return ids, similarities
+
+    def save(self, path: str):
+        state = {
+            'kind': np.array(self.kind),
+            'vectors': self.vectors,
+            'ids': self.ids
+        }
+        if self.centroids is not None:
+            state['centroids'] = self.centroids
+            state['assignments'] = self._assignments[:self.size]
+            state['trained'] = np.array(self.trained)
+
+        with open(path, 'wb') as f:
+            np.savez(f, **state)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as state:
+            index = cls(state['vectors'].shape[1], method=str(state['kind']))
+
+            index._vectors = state['vectors']
+            index._ids = state['ids']
+            index.size = len(index._ids)
+
+            if 'centroids' in state:
+                index.centroids = state['centroids']
+                index._assignments = state['assignments']
+                index.trained = int(state['trained']) if 'trained' in state else index.size
+            else:
+                index._assignments = np.zeros(index.size, dtype=np.int64)
+
+        return index
+
+    def benchmark(self, queries, k: int = 10):
+        ''' Measures per-query latency of exact and indexed search, and the recall of indexed search against exact results. '''
+        queries = _normalize(queries)
+
+        start = time.perf_counter()
+        expected, _ = self.query(queries, k, exact=True)
+        exact = time.perf_counter() - start
+
+        start = time.perf_counter()
+        found, _ = self.query(queries, k)
+        approximate = time.perf_counter() - start
+
+        hits = sum(len(set(e) & set(f)) for e, f in zip(expected.tolist(), found.tolist()))
+
+        return {
+            'size': self.size,
+            'queries': len(queries),
+            'recall': hits / max(1, expected.size),
+            'exact_ms': 1000 * exact / len(queries),
+            'indexed_ms': 1000 * approximate / len(queries)
+        }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Benchmark similarity search recall and latency on synthetic clustered vectors.")  # noqa
+    parser.add_argument("--size", type=int, default=200000, help="Number of indexed vectors.")  # noqa
+    parser.add_argument("--dimensions", type=int, default=300, help="Vector dimensions.")  # noqa
+    parser.add_argument("--queries", type=int, default=100, help="Number of query vectors.")  # noqa
+    parser.add_argument("-k", type=int, default=10, help="Number of neighbours per query.")  # noqa
+    parser.add_argument("--probes", type=int, default=None, help="Inverted lists searched per query.")  # noqa
+    args = parser.parse_args()
+
+    if args.probes is not None:
+        SimilarityIndex.probes = args.probes
+
+    generator = np.random.RandomState(SimilarityIndex.seed)
+    centres = generator.normal(size=(256, args.dimensions))
+    data = centres[generator.randint(256, size=args.size)] + \
+        generator.normal(scale=0.5, size=(args.size, args.dimensions))
+
+    index = SimilarityIndex(args.dimensions, method='ivf')
+
+    start = time.perf_counter()
+    index.add(np.arange(args.size), data)
+    print("Built index over %d vectors in %.2fs." % (args.size, time.perf_counter() - start))
+
+    print(index.benchmark(data[generator.randint(args.size, size=args.queries)], k=args.k))
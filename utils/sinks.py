@@ -0,0 +1,94 @@
+import os
+import csv
+import threading
+
+from utils.compression import Compression
+from utils.metrics import Metrics
+from utils.store import TweetStore
+
+_metrics = Metrics.scope('sink')
+
+header = ['timestamp', 'tweet_text', 'username', 'all_hashtags', 'followers_count', 'location']
+
+
+def row(tweet):
+    return [tweet.created_at, tweet.full_text.replace('\n', ' ').encode('utf-8'), tweet.user.screen_name.encode('utf-8'),
+            [e['text'] for e in tweet._json['entities']['hashtags']], tweet.user.followers_count, tweet.user.location.encode('utf-8')]
+
+
+class Sink:
+    ''' Destination for harvested tweets; write() may be called from several harvesting threads at once. '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, tweets: list):
+        with self._lock, _metrics.timer('write').time():
+            self._write(tweets)
+        _metrics.counter('rows').inc(len(tweets))
+
+    def _write(self, tweets):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class CSVSink(Sink):
+    ''' Writes tweets as CSV rows in the harvest format, appending to an existing file when append is set.
+
+    Paths ending in .gz or .zst are compressed as they are written. '''
+
+    def __init__(self, path: str, append: bool = False):
+        super().__init__()
+
+        new = not append or not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = Compression.open(path, 'a' if append else 'w', newline='')
+        self.writer = csv.writer(self.file)
+
+        if new:
+            self.writer.writerow(header)
+
+    def _write(self, tweets):
+        for tweet in tweets:
+            self.writer.writerow(row(tweet))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class StoreSink(Sink):
+    ''' Adds tweets to a TweetStore, which skips tweets it already holds. '''
+
+    def __init__(self, store: TweetStore):
+        super().__init__()
+        self.store = store
+
+    def _write(self, tweets):
+        self.store.add(tweets)
+
+    def close(self):
+        self.store.close()
+
+
+class Sinks(Sink):
+    ''' Writes every batch to each of several sinks. '''
+
+    def __init__(self, *sinks):
+        super().__init__()
+        self.sinks = list(sinks)
+
+    def write(self, tweets: list):
+        for sink in self.sinks:
+            sink.write(tweets)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,206 @@
+import re
+import json
+import sqlite3
+import argparse
+import threading
+
+from utils.configuration import Configurable
+from utils.metrics import Metrics
+from utils.types import strict
+
+_partition = re.compile(r'^tweets_(\d{6})$')
+
+_columns = ['id', 'created_at', 'screen_name', 'user_id', 'text', 'hashtags', 'followers_count', 'location', 'json']
+
+
+def _time(value):
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class TweetStore(Configurable):
+    ''' SQLite tweet store in WAL mode, with one table of tweets per month of creation.
+
+    Tweets are keyed by ID, so storing a tweet twice keeps the first copy; queries by handle, time range and
+    source reference metadata only read the partitions and index ranges they need. '''
+
+    synchronous = strict(str, 'NORMAL')
+    cache_size = strict(int, -65536)
+
+    _configurable = {
+        'default': {
+            'synchronous': {
+                'type': str,
+                'regex': r'^(OFF|NORMAL|FULL)$'
+            },
+            'cache_size': {
+                'type': int
+            }
+        }
+    }
+
+    _metrics = Metrics.scope('store')
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        connection = self._connection()
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS metadata (handle TEXT NOT NULL, field TEXT NOT NULL, value TEXT, '
+                               'PRIMARY KEY (handle, field))')
+            connection.execute('CREATE INDEX IF NOT EXISTS metadata_field ON metadata (field, value)')
+
+        self.partitions = set(row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'tweets_%'") if _partition.match(row[0]))
+
+    def _connection(self):
+        # SQLite connections may not be shared across threads, so each thread opens its own
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=%s' % self.synchronous)
+            connection.execute('PRAGMA cache_size=%d' % self.cache_size)
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def _partition(self, connection, month):
+        name = 'tweets_%s' % month
+        if name in self.partitions:
+            return name
+
+        with self._lock:
+            connection.execute('CREATE TABLE IF NOT EXISTS %s (id INTEGER PRIMARY KEY, created_at TEXT NOT NULL, '
+                               'screen_name TEXT NOT NULL COLLATE NOCASE, user_id INTEGER, text TEXT, hashtags TEXT, '
+                               'followers_count INTEGER, location TEXT, json TEXT)' % name)
+            connection.execute('CREATE INDEX IF NOT EXISTS %s_handle ON %s (screen_name, created_at)' % (name, name))
+            connection.execute('CREATE INDEX IF NOT EXISTS %s_time ON %s (created_at)' % (name, name))
+            self.partitions.add(name)
+
+        return name
+
+    def add(self, tweets: list):
+        ''' Stores tweepy statuses, skipping tweets already stored; returns the number of new tweets. '''
+        months = {}
+        for tweet in tweets:
+            months.setdefault(tweet.created_at.strftime('%Y%m'), []).append((
+                tweet.id, _time(tweet.created_at), tweet.user.screen_name, tweet.user.id,
+                getattr(tweet, 'full_text', None) or getattr(tweet, 'text', None),
+                json.dumps([e['text'] for e in tweet._json['entities']['hashtags']]),
+                tweet.user.followers_count, tweet.user.location, json.dumps(tweet._json)))
+
+        connection = self._connection()
+        added = 0
+
+        with self._metrics.timer('write').time(), connection:
+            for month, rows in months.items():
+                before = connection.total_changes
+                connection.executemany('INSERT OR IGNORE INTO %s VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)' % self._partition(connection, month), rows)
+                added += connection.total_changes - before
+
+        self._metrics.counter('tweets').inc(added)
+        self._metrics.counter('duplicates').inc(len(tweets) - added)
+
+        return added
+
+    def add_source(self, source):
+        ''' Stores the reference metadata of every account in a DataSource, for queries by party, state, chamber, etc. '''
+        rows = []
+        for handle, reference in source.handles().items():
+            for field, value in reference.get('metadata', {}).items():
+                rows.append((handle, field, value if isinstance(value, str) else json.dumps(value)))
+
+        connection = self._connection()
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?)', rows)
+
+    def _partitions(self, start, end):
+        # Partitions are months, so a time range only reads the months it overlaps
+        first = start[:7].replace('-', '') if start is not None else None
+        last = end[:7].replace('-', '') if end is not None else None
+        return sorted(name for name in self.partitions
+                      if (first is None or name[7:] >= first) and (last is None or name[7:] <= last))
+
+    def query(self, handles: list = None, start=None, end=None, columns: list = None, limit: int = None, **metadata):
+        ''' Yields stored tweets as dicts, oldest first, by handle, by creation time range [start, end), and by
+        reference metadata values, e.g. query(party='Democrat', chamber='Senate'). '''
+        start, end = _time(start), _time(end)
+        columns = columns if columns is not None else [c for c in _columns if c != 'json']
+        for column in columns:
+            if column not in _columns:
+                raise Exception("Unknown tweet store column '%s'; must be one of %s." % (column, _columns))
+
+        conditions = []
+        parameters = []
+
+        if handles is not None:
+            conditions.append('screen_name IN (%s)' % ', '.join('?' * len(handles)))
+            parameters += list(handles)
+        if start is not None:
+            conditions.append('created_at >= ?')
+            parameters.append(start)
+        if end is not None:
+            conditions.append('created_at < ?')
+            parameters.append(end)
+        for field, value in metadata.items():
+            conditions.append('screen_name IN (SELECT handle FROM metadata WHERE field = ? AND value = ?)')
+            parameters += [field, value]
+
+        partitions = self._partitions(start, end)
+        if len(partitions) == 0:
+            return
+
+        where = ' WHERE ' + ' AND '.join(conditions) if len(conditions) > 0 else ''
+        sql = ' UNION ALL '.join('SELECT %s FROM %s%s' % (', '.join(columns + ['created_at AS _order']), name, where)
+                                 for name in partitions)
+        sql += ' ORDER BY _order'
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+
+        with self._metrics.timer('query').time():
+            cursor = self._connection().execute(sql, parameters * len(partitions))
+
+        for row in cursor:
+            yield {column: row[column] for column in columns}
+
+    def count(self):
+        connection = self._connection()
+        return sum(connection.execute('SELECT COUNT(*) FROM %s' % name).fetchone()[0] for name in sorted(self.partitions))
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Query a local tweet store.")  # noqa
+    parser.add_argument("store", type=str, help="Tweet store file path.")  # noqa
+    parser.add_argument("--source", type=str, action='append', help="Store the reference metadata of this source file.")  # noqa
+    parser.add_argument("--handle", type=str, action='append', help="Only return tweets by this handle.")  # noqa
+    parser.add_argument("--start", type=str, default=None, help="Only return tweets created at or after this time (YYYY-MM-DD[ HH:MM:SS]).")  # noqa
+    parser.add_argument("--end", type=str, default=None, help="Only return tweets created before this time (YYYY-MM-DD[ HH:MM:SS]).")  # noqa
+    parser.add_argument("--where", type=str, action='append', help="Only return tweets by accounts whose metadata field=value.")  # noqa
+    parser.add_argument("--limit", type=int, default=None, help="Return at most this many tweets.")  # noqa
+    parser.add_argument("--count", action='store_true', help="Print the number of stored tweets.")  # noqa
+    args = parser.parse_args()
+
+    from data_source import DataSource
+
+    store = TweetStore(args.store)
+
+    for path in args.source or []:
+        store.add_source(DataSource(path))
+
+    if args.count:
+        print(store.count())
+    else:
+        metadata = dict(condition.split('=', 1) for condition in args.where or [])
+        for tweet in store.query(args.handle, args.start, args.end, limit=args.limit, **metadata):
+            print(json.dumps(tweet))
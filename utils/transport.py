@@ -0,0 +1,189 @@
+import time
+import random
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.configuration import Configurable, TriggerableConfiguration
+from utils.metrics import Metrics
+from utils.types import strict
+
+_retried = (500, 502, 503, 504)
+
+
+class _CountingAdapter(HTTPAdapter):
+    ''' Connection pool adapter that counts the connections it opens, so reuse is the requests it sent over old ones. '''
+
+    def __init__(self, *args, **kwargs):
+        self._seen = {}
+        self._lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+
+        pool = self.poolmanager.connection_from_url(request.url)
+        with self._lock:
+            opened = pool.num_connections - self._seen.get(id(pool), 0)
+            self._seen[id(pool)] = pool.num_connections
+
+        Transport._metrics.counter('requests').inc()
+        Transport._metrics.counter('connections').inc(opened)
+        if opened == 0:
+            Transport._metrics.counter('reused').inc()
+
+        return response
+
+
+class Transport(Configurable):
+    ''' Shared keep-alive HTTP sessions, one per host, with a bounded connection pool each.
+
+    Requests retry connection errors, timeouts and 5xx responses with exponential backoff and full jitter within a
+    per-request deadline, and wait out 429 responses until their rate-limit window resets. Time spent waiting for a
+    window does not count against the deadline; 429s still count as attempts, and windows longer than rate_limit_wait
+    are returned at once. '''
+
+    pool_size = strict(int, 10)
+    retries = strict(int, 5)
+    backoff = strict(float, 0.5)
+    max_backoff = strict(float, 30.0)
+    timeout = strict(float, 10.0)
+    deadline = strict(float, 120.0)
+    rate_limit_wait = strict(float, 960.0)
+
+    _sessions = {}
+    _lock = threading.Lock()
+    _metrics = Metrics.scope('http')
+
+    @classmethod
+    def _pool_trigger(cls, key, old_value, new_value):
+        # Sessions are sized when built, so reloaded pool sizes take effect by building them again
+        cls.close()
+
+    _configurable = TriggerableConfiguration({
+        'default': {
+            'pool_size': {
+                'type': int
+            },
+            'retries': {
+                'type': int
+            },
+            'backoff': {
+                'type': float
+            },
+            'max_backoff': {
+                'type': float
+            },
+            'timeout': {
+                'type': float
+            },
+            'deadline': {
+                'type': float
+            },
+            'rate_limit_wait': {
+                'type': float
+            }
+        },
+        'pools': {
+            'api.twitter.com': {
+                'type': int
+            },
+            'upload.twitter.com': {
+                'type': int
+            }
+        }
+    }, {
+        'pool_size': [_pool_trigger],
+        'api.twitter.com': [_pool_trigger],
+        'upload.twitter.com': [_pool_trigger]
+    })
+
+    @classmethod
+    def session(cls, host: str):
+        ''' Returns the shared session for a host, sized by its [Transport.pools] option or pool_size. '''
+        session = cls._sessions.get(host)
+        if session is not None:
+            return session
+
+        with cls._lock:
+            if host not in cls._sessions:
+                size = cls._config.get('pools', {}).get(host, cls.pool_size)
+
+                # Block for a free connection rather than open unpooled ones past the bound
+                adapter = _CountingAdapter(pool_connections=1, pool_maxsize=size, pool_block=True, max_retries=0)
+
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                cls._sessions[host] = session
+
+            return cls._sessions[host]
+
+    @classmethod
+    def _delay(cls, attempt):
+        return random.uniform(0, min(cls.max_backoff, cls.backoff * 2 ** attempt))
+
+    @classmethod
+    def request(cls, method: str, url: str, deadline: float = None, **kwargs):
+        ''' Sends a request over the host's shared session, retrying transient failures until the deadline (seconds). '''
+        deadline = time.monotonic() + (deadline if deadline is not None else cls.deadline)
+        session = cls.session(urlsplit(url).netloc)
+
+        attempt = 0
+        while True:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                raise Exception("Request %s %s exceeded its deadline." % (method, url))
+
+            error = None
+            try:
+                response = session.request(method, url, timeout=min(cls.timeout, left), **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt >= cls.retries:
+                    raise
+                wait = cls._delay(attempt)
+                error = e
+            else:
+                if response.status_code == 429 and 'x-rate-limit-reset' in response.headers:
+                    wait = float(response.headers['x-rate-limit-reset']) - time.time() + 1
+                    if wait > cls.rate_limit_wait or attempt >= cls.retries:
+                        return response
+                    # A reset already in the past (e.g. clock skew) still backs off, and every 429 counts as an attempt
+                    wait = max(cls._delay(attempt), wait)
+                    cls._metrics.histogram('rate_limit_wait').observe(wait)
+                    response.close()
+                    time.sleep(wait)
+                    # A rate-limit window is not a failure, so waiting it out extends the deadline
+                    deadline += wait
+                    attempt += 1
+                    continue
+                elif response.status_code in _retried and attempt < cls.retries:
+                    wait = cls._delay(attempt)
+                else:
+                    return response
+
+            if wait > deadline - time.monotonic():
+                if error is not None:
+                    raise error
+                return response
+
+            if error is None:
+                # Release the connection back to the pool while waiting
+                response.close()
+
+            cls._metrics.counter('retries').inc()
+            time.sleep(wait)
+            attempt += 1
+
+    @classmethod
+    def get(cls, url: str, **kwargs):
+        return cls.request('GET', url, **kwargs)
+
+    @classmethod
+    def close(cls):
+        with cls._lock:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
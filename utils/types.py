@@ -1,47 +1,76 @@
-import traceback
+class strict(object):
+    ''' Typed attribute whose class-level value is the default for every instance.
 
+    Instances store their own value, in their __dict__ or, for classes with __slots__, in the slot named by
+    strict.slots(); type checks are skipped when Python runs optimized (-O). '''
+
+    __slots__ = ('dtype', 'value', 'name', 'slot')
 
-class strict(object):
     def __init__(self, dtype, value):
         if type(value) is not dtype and value is not None:
-            raise ValueError("When strict types are enabled, initial value must match type (%s)" %
-                             traceback.extract_stack()[-3].line)
+            raise ValueError("When strict types are enabled, initial value must match type (%s): %r does not." % (
+                dtype.__name__, value))
         self.dtype = dtype
         self.value = value
+        self.name = None
+        self.slot = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.slot = '_strict_' + name
+
+    @staticmethod
+    def slots(*names):
+        return tuple('_strict_' + name for name in names)
 
     def __get__(self, instance, owner):
-        return self.value
+        if instance is None:
+            return self.value
+        try:
+            return instance.__dict__.get(self.name, self.value)
+        except AttributeError:
+            return getattr(instance, self.slot, self.value)
 
     def __set__(self, instance, value):
-        assert type(value) is self.dtype or value is None
-        self.value = value
+        if __debug__ and type(value) is not self.dtype and value is not None:
+            raise ValueError("Setting value of %s in instance of %s.%s must match strict type %s: %s (%s) does not." % (
+                self.name, type(instance).__module__, type(instance).__name__, self.dtype.__name__, str(value), type(value).__name__))
+        try:
+            instance.__dict__[self.name] = value
+        except AttributeError:
+            object.__setattr__(instance, self.slot, value)
 
 
 class _st(type):
+    def __init__(self, name, bases, dct):
+        super().__init__(name, bases, dct)
+
+        # Strict field types are collected once per class, so class-level assignment is a single dict lookup
+        fields = {}
+        for klass in reversed(self.__mro__):
+            for attr, value in vars(klass).items():
+                if type(value) is strict:
+                    fields[attr] = value.dtype
+        type.__setattr__(self, '_strict', fields)
+
     def __setattr__(self, attr, value):
-        if hasattr(self, attr) and hasattr(getattr(self, attr), '__set__'):
-            try:
-                getattr(self, attr).__set__(self, value)
-            except AssertionError as e:
-                if type(getattr(self, attr)) is strict:
-                    stack = traceback.extract_stack()
-                    cause = stack[-min(2, len(stack))]
-                    raise ValueError("Setting value of %s in class %s.%s must match strict type %s: %s does not.\n%s line %d %s:\n\t%s" % (
-                        attr, self.__module__, self.__name__, getattr(self, attr).dtype.__name__, str(value), *cause)) from e
+        dtype = self._strict.get(attr)
+        if dtype is None:
+            return super().__setattr__(attr, value)
+
+        if __debug__ and type(value) is not dtype and value is not None:
+            raise ValueError("Setting value of %s in class %s.%s must match strict type %s: %s does not." % (
+                attr, self.__module__, self.__name__, dtype.__name__, str(value)))
+
+        field = self.__dict__.get(attr)
+        if type(field) is strict:
+            field.value = value
         else:
-            super().__setattr__(attr, value)
+            # Give the class its own field, so the value does not leak to its bases
+            field = strict(dtype, value)
+            field.__set_name__(self, attr)
+            type.__setattr__(self, attr, field)
 
 
 class StrictTypes(metaclass=_st):
-    def __setattr__(self, attr, value):
-        if attr in self.__dict__ and hasattr(self.__dict__[attr], '__set__'):
-            try:
-                getattr(self, attr).__set__(self, value)
-            except AssertionError as e:
-                if type(getattr(self, attr)) is strict:
-                    stack = traceback.extract_stack()
-                    cause = stack[-min(2, len(stack))]
-                    raise ValueError("Setting value of %s in instance of %s.%s must match strict type %s: %s (%s) does not.\n%s line %d %s:\n\t%s" % (
-                        attr, self.__class__.__module__, self.__class__.__name__, getattr(self, attr).dtype.__name__, str(value), type(value).__name__, *cause)) from e
-        else:
-            self.__dict__[attr] = value
+    __slots__ = ()
@@ -1,7 +1,11 @@
 from secrets import token_bytes
 from binascii import hexlify
+from itertools import count
+import os
 import time
 
+_counter = count()
+
 
 def uuidv4():
     data = bytearray(token_bytes(16))
@@ -11,3 +15,8 @@ def uuidv4():
     data[8] ^= 128
     data = hexlify(data).decode('ascii')
     return f'{data[:8]}-{data[8:12]}-{data[12:16]}-{data[16:20]}-{data[20:]}'
+
+
+def fastid(prefix: str = 'id'):
+    # Unique within the process, and across forked processes by their ID; not for anything that must be unguessable
+    return '%s-%x-%x' % (prefix, os.getpid(), next(_counter))
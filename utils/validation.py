@@ -1,5 +1,6 @@
 import re
-import typing.re
+import timeit
+import argparse
 
 
 class regex:
@@ -15,7 +16,115 @@ class regex:
         snakes = re.compile('^(_?[A-Za-z0-9]+)+$')
 
 
-def validate_string(string: str, label: str, regex: typing.re.Pattern = None, min_len: int = 1, max_len: int = None):
+_validators = {}
+
+
+def _fail(label, reason):
+    raise Exception("Failed to validate string for %s: %s" % (label, reason)) from None
+
+
+def compile_string(label: str, regex: re.Pattern = None, min_len: int = 1, max_len: int = None):
+    ''' Compiles string checks into a validator function, checking the schema itself once instead of on every call.
+
+    The validator returns the string it is given, or raises as validate_string does. '''
+    key = (label, regex, min_len, max_len)
+    validator = _validators.get(key)
+    if validator is not None:
+        return validator
+
+    if isinstance(regex, str):
+        regex = re.compile(regex)
+
+    try:
+        if not isinstance(label, str):
+            raise Exception("Validation label must be a string.")
+        if min_len is not None and not isinstance(min_len, int):
+            raise Exception("Minimum length must be an integer.")
+        if max_len is not None and not isinstance(max_len, int):
+            raise Exception("Maximum length must be an integer.")
+        if regex is not None and not isinstance(regex, re.Pattern):
+            raise Exception("Validation pattern must be a compiled RegEx pattern.")
+    except Exception as e:
+        _fail(label, e)
+
+    # Absent bounds become bounds that always hold, so the validator has no branches on the schema
+    low = min_len if min_len is not None else 0
+    high = max_len if max_len is not None else float('inf')
+    match = regex.match if regex is not None else None
+    pattern = regex.pattern if regex is not None else None
+
+    def validator(string):
+        if not isinstance(string, str):
+            _fail(label, "Must be a string.")
+        length = len(string)
+        if length < low:
+            _fail(label, "Must be at least %d characters long." % low)
+        if length > high:
+            _fail(label, "Must be no more than %d characters long." % high)
+        if match is not None and match(string) is None:
+            _fail(label, "Must match pattern '%s'." % pattern)
+        return string
+
+    _validators[key] = validator
+    return validator
+
+
+def compile_fields(fields: dict, label: str):
+    ''' Compiles a {name: {'type': type, 'regex': pattern, 'min_len': int, 'max_len': int}} schema into a validator
+    of dicts holding exactly those fields. '''
+    try:
+        if not isinstance(fields, dict):
+            raise Exception("Field schema must be a dict.")
+
+        checks = {}
+        for name, spec in fields.items():
+            if not isinstance(spec, dict):
+                raise Exception("Field '%s' must be described by a dict." % name)
+            for option in spec:
+                if option not in ('type', 'regex', 'min_len', 'max_len'):
+                    raise Exception("Unknown option '%s' for field '%s'." % (option, name))
+
+            dtype = spec.get('type', str)
+            if not isinstance(dtype, type):
+                raise Exception("Type of field '%s' must be a type." % name)
+
+            string = None
+            if dtype is str:
+                try:
+                    string = compile_string('%s field %s' % (label, name), spec.get('regex'),
+                                            spec.get('min_len', 1), spec.get('max_len'))
+                except re.error as e:
+                    raise Exception("Pattern of field '%s' is invalid: %s." % (name, e))
+            elif 'regex' in spec:
+                raise Exception("Field '%s' may only have a pattern if it is a string." % name)
+
+            checks[name] = (dtype, string)
+    except Exception as e:
+        raise Exception("Failed to compile field schema for %s: %s" % (label, e)) from None
+
+    names = frozenset(checks)
+
+    def validator(values):
+        if values.keys() != names:
+            for key in values:
+                if key not in names:
+                    raise Exception("Unknown field '%s' for %s." % (key, label))
+            for key in names:
+                if key not in values:
+                    raise Exception("Missing required field '%s' for %s." % (key, label))
+
+        for key, (dtype, string) in checks.items():
+            value = values[key]
+            if string is not None:
+                string(value)
+            elif not isinstance(value, dtype):
+                raise Exception("Field '%s' for %s must be of type %s." % (key, label, dtype.__name__))
+        return values
+
+    return validator
+
+
+def validate_string(string: str, label: str, regex: re.Pattern = None, min_len: int = 1, max_len: int = None):
     try:
         if not isinstance(label, str):
             raise Exception("Validation label must be a string.")
@@ -37,7 +146,7 @@ def validate_string(string: str, label: str, regex: typing.re.Pattern = None, mi
                     "Must be no more than %d characters long." % max_len)
 
         if regex is not None:
-            if not isinstance(regex, typing.re.Pattern):
+            if not isinstance(regex, re.Pattern):
                 raise Exception(
                     "Validation pattern must be a compiled RegEx pattern.")
             if not regex.match(string):
@@ -45,3 +154,38 @@ def validate_string(string: str, label: str, regex: typing.re.Pattern = None, mi
     except Exception as e:
         raise Exception(
             "Failed to validate string for %s: %s" % (label, e)) from None
+
+
+def benchmark(number: int = 100000):
+    ''' Times validating a credential name, and the details of an OAuth consumer credential, by interpreting their
+    schemas on every call and with compiled validators; returns seconds per call for each. '''
+    name = 'twitter-ssdc-consumer'
+    kebabs = regex.complete.kebabs
+    compiled = compile_string('credential name', kebabs, 1, 36)
+
+    fields = {'key': {'type': str, 'regex': f'^{regex.partial.urlb64}+$'},
+              'secret': {'type': str, 'regex': f'^{regex.partial.urlb64}+$'}}
+    details = {'key': 'x' * 25, 'secret': 'y' * 50}
+    compiled_fields = compile_fields(fields, 'benchmark')
+
+    def interpreted_fields():
+        for key, spec in fields.items():
+            validate_string(details[key], key, re.compile(spec['regex']))
+
+    timings = {
+        'name': timeit.timeit(lambda: validate_string(name, 'credential name', kebabs, 1, 36), number=number),
+        'name, compiled': timeit.timeit(lambda: compiled(name), number=number),
+        'fields': timeit.timeit(interpreted_fields, number=number),
+        'fields, compiled': timeit.timeit(lambda: compiled_fields(details), number=number)
+    }
+
+    return {method: seconds / number for method, seconds in timings.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser("Benchmark validate_string against a compiled string validator.")  # noqa
+    parser.add_argument("-n", "--number", type=int, default=100000, help="Validations to time per method.")  # noqa
+    args = parser.parse_args()
+
+    for method, seconds in benchmark(args.number).items():
+        print('%-16s %8.1f ns' % (method, seconds * 1e9))